@@ -0,0 +1,144 @@
+import time
+
+import numpy as np
+
+from Engine import gates
+
+# Computer opponent: expectimax search where the player to move picks its best move and a measurement
+# is worth the average over its outcomes, weighted by their probabilities.
+# Search deepens one move at a time until the time budget runs out and plays the best move of the deepest
+# finished search. Values are from the point of view of the player to move.
+
+win_score = 1e6
+window_weights = np.array([0, 1, 4, 16, 0]) # a window of four with k own coins and none of the opponent's
+
+class Timeout(Exception):
+    pass
+
+def windows(b):
+    # number of own coins in each window of four, for the four directions of a (columns, rows) boolean board
+    b = b.astype(int)
+    return [b[:-3] + b[1:-2] + b[2:-1] + b[3:],
+            b[:, :-3] + b[:, 1:-2] + b[:, 2:-1] + b[:, 3:],
+            b[:-3, :-3] + b[1:-2, 1:-2] + b[2:-1, 2:-1] + b[3:, 3:],
+            b[:-3, 3:] + b[1:-2, 2:-1] + b[2:-1, 1:-2] + b[3:, :-3]]
+
+def board_score(board, player):
+    # open windows of the player minus those of the opponent, more coins in a window count for more
+    score = 0
+    for own, opp in zip(windows(board == player), windows(board == 1 - player)):
+        score += window_weights[own[opp == 0]].sum() - window_weights[opp[own == 0]].sum()
+    return int(score)
+
+def position_key(game):
+    # board, whose turn and the statevector up to global phase, rounded so that the same position
+    # reached by different gate orders gives the same key
+    psi = game.state.data
+    big = psi[np.argmax(np.abs(psi))]
+    psi = np.round(psi*(np.conj(big)/abs(big)), 6) + 0.0 # + 0.0 turns -0.0 into 0.0
+    return hash((game.board.tobytes(), game.coin_array.tobytes(), game.turn, psi.tobytes()))
+
+class Search:
+    def __init__(self, budget = 1.0, max_depth = 6, gates = gates, table_size = 2**18):
+        self.budget = budget # seconds per move
+        self.max_depth = max_depth
+        self.gates = gates # gates the search tries, measurements are always tried
+        self.table_size = table_size
+        self.table = {} # position key -> (depth searched, value, best move)
+        self.scores = {} # board bytes -> board_score for each player
+        self.deadline = None
+        self.nodes = 0
+        self.reached = 0 # depth of the last finished search
+
+    def __call__(self, game, rng = None):
+        # so it can be used as a SelfPlay policy
+        return self.best_move(game)
+
+    def moves(self, game):
+        cols = game.open_columns()
+        moves = [("measure", [a]) for a in cols]
+        for move in game.legal_moves():
+            if move[0] == "measure" or move[0] not in self.gates:
+                continue
+            if move[0] == "ccx" and move[1][0] > move[1][1]: # the controls commute, ccx(a, b, c) is ccx(b, a, c)
+                continue
+            moves.append(move)
+        return moves
+
+    def evaluate(self, game):
+        key = game.board.tobytes()
+        if key not in self.scores:
+            self.scores[key] = [board_score(game.board, 0), board_score(game.board, 1)]
+        return self.scores[key][game.turn]
+
+    def value(self, game, depth):
+        if game.winner != -1:
+            # sooner wins and later losses are better
+            return (win_score + depth) if game.winner == game.turn else -(win_score + depth)
+        if (game.coin_array == game.columns).all():
+            return 0
+        if depth == 0:
+            return self.evaluate(game)
+        self.nodes += 1
+        if self.nodes % 64 == 0 and time.perf_counter() > self.deadline:
+            raise Timeout()
+
+        key = position_key(game)
+        entry = self.table.get(key)
+        if entry is not None and entry[0] >= depth:
+            return entry[1]
+        moves = self.moves(game)
+        if entry is not None and entry[2] in moves: # best move of a shallower search first
+            moves.remove(entry[2])
+            moves.insert(0, entry[2])
+
+        best = None
+        for move in moves:
+            v = self.move_value(game, move, depth)
+            if best is None or v > best[0]:
+                best = (v, move)
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        self.table[key] = (depth, best[0], best[1])
+        return best[0]
+
+    def move_value(self, game, move, depth):
+        saved = game.save()
+        if move[0] != "measure":
+            game.play(move)
+            v = -self.value(game, depth - 1)
+            game.restore(saved)
+            return v
+        v = 0
+        for outcome, p in enumerate(game.state.marginals()[move[1][0]]):
+            if p < 1e-9:
+                continue
+            game.play(move, outcome)
+            v -= p*self.value(game, depth - 1)
+            game.restore(saved)
+        return v
+
+    def best_move(self, game):
+        # searches a headless copy, the game itself is not touched
+        game = game.fork()
+        self.deadline = time.perf_counter() + self.budget
+        self.nodes = 0
+        self.reached = 0
+        moves = self.moves(game)
+        best = (None, moves[0])
+        for depth in range(1, self.max_depth + 1):
+            found = None
+            try:
+                for move in moves:
+                    v = self.move_value(game, move, depth)
+                    if found is None or v > found[0]:
+                        found = (v, move)
+            except Timeout:
+                break
+            best = found
+            self.reached = depth
+            if abs(best[0]) >= win_score:
+                break
+            moves.remove(best[1])
+            moves.insert(0, best[1])
+        return best[1]
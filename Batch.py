@@ -0,0 +1,208 @@
+import numpy as np
+
+import Simulator
+from Simulator import QuantumState
+from Engine import Engine
+from SelfPlay import RandomPolicy
+
+def four_in_a_row(b):
+    # b is a (games, columns, rows) boolean array of one player's coins, returns which games have a line of four
+    lines = [b[:, :-3] & b[:, 1:-2] & b[:, 2:-1] & b[:, 3:], # horizontal
+             b[:, :, :-3] & b[:, :, 1:-2] & b[:, :, 2:-1] & b[:, :, 3:], # vertical
+             b[:, :-3, :-3] & b[:, 1:-2, 1:-2] & b[:, 2:-1, 2:-1] & b[:, 3:, 3:], # diagonal
+             b[:, :-3, 3:] & b[:, 1:-2, 2:-1] & b[:, 2:-1, 1:-2] & b[:, 3:, :-3]] # antidiagonal
+    won = np.zeros(len(b), dtype=bool)
+    for line in lines:
+        won |= line.reshape(len(b), -1).any(axis=1)
+    return won
+
+class GameView:
+    # the parts of an Engine the SelfPlay random policy looks at, for one game of a batch
+    def __init__(self, batch, i):
+        self.columns = batch.columns
+        self.coin_array = batch.coin_array[i]
+        self.turn = batch.turn[i]
+
+    def open_columns(self):
+        return [a for a in range(self.columns) if self.coin_array[a] < self.columns]
+
+class BatchEngine:
+    # N games on the same number of columns with their statevectors stacked in one (N, 2^n) array.
+    # Each game draws from its own generator exactly as Engine does, so game i plays out like
+    # Engine(cols, seeds[i], depth, starts[i]) with state.rng = default_rng(rng_seeds[i]) given the same moves
+    # (up to the rounding of the gate runs Engine fuses, the batch applies gates one at a time).
+    def __init__(self, cols, seeds, depth = 2, starts = None, rng_seeds = None):
+        self.columns = cols
+        self.depth = depth
+        self.size = len(seeds)
+        self.seeds = list(seeds)
+
+        #initial states, each distinct seed is generated once
+        self.data = np.empty((self.size, 2**cols), dtype=complex)
+        initial = {}
+        for i in range(self.size):
+            if seeds[i] not in initial:
+                initial[seeds[i]] = Engine(cols, seeds[i], depth).state.data
+            self.data[i] = initial[seeds[i]]
+        self.cache = None
+
+        self.turn = np.array([0]*self.size if starts is None else starts, dtype=int)
+        self.move_no = np.zeros(self.size, dtype=int)
+        self.winner = np.full(self.size, -1)
+        #board[i, x, h] is game i, column x, height h counted from the bottom
+        self.board = np.full((self.size, cols, cols), -1, dtype=np.int8)
+        self.coin_array = np.zeros((self.size, cols), dtype=int)
+        if rng_seeds is None:
+            rng_seeds = [None]*self.size
+        self.rngs = [np.random.default_rng(s) for s in rng_seeds]
+
+    def tensor(self):
+        return self.data.reshape((self.size,) + (2,)*self.columns)
+
+    def marginals(self):
+        #(N, n, 2) single qubit marginals of every game, cached until the states change
+        if self.cache is None:
+            self.cache = Simulator.marginals(self.data, self.columns)
+        return self.cache
+
+    def pure(self, marg):
+        p0 = marg[..., 0]
+        return np.isclose(p0, 0.0, 1e-3) | np.isclose(p0, 1.0, 1e-3)
+
+    def active(self):
+        return (self.winner == -1) & (self.coin_array < self.columns).any(axis=1)
+
+    def apply_gates(self, moves):
+        #moves has a (gate, qubits) or None per game, games playing the same gate on the same qubits are updated together
+        groups = {}
+        for i in range(self.size):
+            if moves[i] is not None:
+                groups.setdefault((moves[i][0], tuple(moves[i][1])), []).append(i)
+        psi = self.tensor()
+        for (gate, args), rows in groups.items():
+            if len(rows) == self.size:
+                Simulator.apply_gate(psi, self.columns, gate, list(args))
+            else:
+                sub = psi[rows]
+                Simulator.apply_gate(sub, self.columns, gate, list(args))
+                psi[rows] = sub
+        if groups:
+            self.cache = None
+
+    def measure(self, columns):
+        #columns has the column each game measures or -1, returns the (positions, results) of every game
+        columns = np.asarray(columns)
+        rows = np.flatnonzero(columns >= 0)
+        placed = [([], []) for i in range(self.size)]
+        if len(rows) == 0:
+            return placed
+        n = self.columns
+        q = columns[rows]
+
+        marg = self.marginals()
+        pure_before = self.pure(marg[rows])
+
+        #one uniform per game from its own generator, outcome as Generator.choice picks it
+        probs = marg[rows, q]
+        u = np.array([self.rngs[i].random() for i in rows])
+        outcome = (u >= probs[:, 0]/(probs[:, 0] + probs[:, 1])).astype(int)
+        prob = probs[np.arange(len(rows)), outcome]
+
+        #collapse, games measuring the same column onto the same outcome are zeroed together
+        psi = self.tensor()
+        for col in np.unique(q):
+            for o in [0, 1]:
+                sel = rows[(q == col) & (outcome == o)]
+                if len(sel):
+                    psi[(sel,) + Simulator.index(n, [col], [1 - o])[1:]] = 0
+        self.data[rows] /= np.sqrt(prob)[:, None]
+        self.cache = None
+
+        for k in range(len(rows)):
+            placed[rows[k]][0].append(int(q[k]))
+            placed[rows[k]][1].append(int(outcome[k]))
+
+        #qubits made pure by the measurement collapse too, this is rare so it is done game by game
+        pure_after = self.pure(self.marginals()[rows])
+        new = pure_after & ~pure_before
+        new[np.arange(len(rows)), q] = False
+        for k in np.flatnonzero(new.any(axis=1)):
+            i = rows[k]
+            extras = [int(a) for a in np.flatnonzero(new[k])]
+            state = QuantumState(n, self.data[i])
+            state.cache = self.cache[i]
+            state.rng = self.rngs[i]
+            res_extra = state.measure(extras)
+            self.data[i] = state.data
+            for b in range(len(extras)):
+                placed[i][0].append(extras[b])
+                placed[i][1].append((res_extra >> b) & 1)
+        if new.any():
+            self.cache = None
+
+        #coins and wins
+        for i in rows:
+            for x, r in zip(*placed[i]):
+                self.board[i, x, self.coin_array[i, x]] = r
+                self.coin_array[i, x] += 1
+        sub = self.board[rows]
+        won = four_in_a_row(sub == 0) | four_in_a_row(sub == 1)
+        for i in rows[won]:
+            self.winner[i] = self.first_win(i, placed[i][0])
+        return placed
+
+    def first_win(self, i, positions):
+        #winner as Engine.check_coins finds it: the first new coin that is part of a line
+        for x in positions:
+            h = self.coin_array[i, x] - 1
+            player = self.board[i, x, h]
+            if self.line_through(self.board[i] == player, x, h):
+                return int(player)
+        return -1
+
+    def line_through(self, b, x, h):
+        cols, rows = b.shape
+        for dx, dh in [(1, 0), (0, 1), (1, 1), (1, -1)]:
+            count = 1
+            for sign in [1, -1]:
+                a = 1
+                while 0 <= x + sign*a*dx < cols and 0 <= h + sign*a*dh < rows and b[x + sign*a*dx, h + sign*a*dh]:
+                    count += 1
+                    a += 1
+            if count >= 4:
+                return True
+        return False
+
+    def step(self, moves):
+        #one move per game (None for games that sit this one out), like Engine.play for each of them
+        gate_moves = [m if m is not None and m[0] != "measure" else None for m in moves]
+        columns = [m[1][0] if m is not None and m[0] == "measure" else -1 for m in moves]
+        self.apply_gates(gate_moves)
+        placed = self.measure(columns)
+        played = np.array([m is not None for m in moves])
+        self.move_no[played] += 1
+        self.turn[played] = 1 - self.turn[played]
+        return placed
+
+    def policy_moves(self, policies, max_moves = None):
+        #moves of (picklable, Engine-free) policies such as SelfPlay.RandomPolicy, None for finished games
+        active = self.active()
+        if max_moves is not None:
+            active &= self.move_no < max_moves
+        moves = [None]*self.size
+        for i in np.flatnonzero(active):
+            moves[i] = policies[self.turn[i]](GameView(self, i), self.rngs[i])
+        return moves
+
+    def run(self, policies = None, max_moves = None):
+        #plays every game to the end, returns the winners (-1 for none) and game lengths
+        if policies is None:
+            policies = [RandomPolicy(), RandomPolicy()]
+        if max_moves is None:
+            max_moves = 10*self.columns*self.columns
+        while True:
+            moves = self.policy_moves(policies, max_moves)
+            if all(m is None for m in moves):
+                break
+            self.step(moves)
+        return self.winner.copy(), self.move_no.copy()
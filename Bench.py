@@ -0,0 +1,225 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from Engine import Engine, gates, gate_sizes
+import Initial
+import Protocol
+
+# Benchmarks of the engine, rendering and network hot paths over a sweep of board sizes and depths.
+# Each result has the median and 95th percentile time of a call in ms and the peak memory allocated by one call
+# (from a separate run under tracemalloc, so tracing does not slow the timed calls).
+# Results are written as JSON; --compare checks them against an earlier run and fails on regressions.
+
+groups = ["engine", "render", "network"]
+
+#disp_* method of each view
+disp_names = {"board": "disp_board", "circuit": "disp_circuit", "qsphere": "disp_qsphere", "bloch": "disp_bloch_multivector"}
+
+def timings(fn, repeat, setup = None):
+    times = []
+    for r in range(repeat):
+        arg = setup() if setup is not None else None
+        t = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - t)
+    return times
+
+def peak_memory(fn, setup = None):
+    arg = setup() if setup is not None else None
+    tracemalloc.start()
+    fn(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def result(name, fn, repeat, setup = None, **params):
+    fn(setup() if setup is not None else None) # warm up, the first call can include imports
+    times = np.array(timings(fn, repeat, setup))*1000
+    record = {"name": name}
+    record.update(params)
+    record.update(repeat = repeat, median_ms = float(np.median(times)), p95_ms = float(np.percentile(times, 95)),
+                  peak_kb = peak_memory(fn, setup)/1024)
+    return record
+
+def playable_seed(cols, depth, seed):
+    # some seeds give an initial circuit that can't be played on a board this size, take the next one that can
+    while True:
+        try:
+            Engine(cols, seed, depth)
+            return seed
+        except ValueError:
+            seed += 1
+
+def bench_engine(cols, depth, seed, repeat):
+    seed = playable_seed(cols, depth, seed)
+    params = dict(columns = cols, depth = depth, seed = seed)
+    #building and simulating the initial circuit, and a new game on a seed already in the cache
+    results = [result("generate_random", lambda a: Initial.simulate(Initial.Program(cols, seed, depth)), repeat, **params),
+               result("new_game", lambda a: Engine(cols, seed, depth), repeat, **params)]
+
+    #each gate applied to the statevector: apply_gate only queues it, sync runs the kernel
+    game = Engine(cols, seed, depth)
+    def add_gate(gate, args):
+        game.apply_gate(gate, args)
+        game.state.sync()
+    for gate in gates:
+        args = list(range(gate_sizes.get(gate, 1)))
+        results.append(result("add_gate", lambda a: add_gate(gate, args), repeat, gate = gate, **params))
+
+    #a run of single qubit gates on one column and the state brought up to date, as in quick scripted play
+    game = Engine(cols, seed, depth)
+    def gate_run(a):
+        for gate in ["h", "t", "h", "s", "x", "z", "y", "h"]:
+            game.apply_gate(gate, [0])
+        game.state.sync()
+    results.append(result("gate_run", gate_run, repeat, **params))
+
+    #measuring the same column of the initial state each time, including the collapse of any newly pure columns
+    game = Engine(cols, seed, depth)
+    saved = game.save()
+    results.append(result("measure", lambda a: game.measure_column(cols//2), repeat, lambda: game.restore(saved), **params))
+
+    #a board about half full of random coins
+    game = Engine(cols, seed, depth)
+    rng = np.random.default_rng(seed)
+    game.state.rng = rng
+    while game.coin_array.sum() < cols*cols//2 and not game.over():
+        game.measure_column(int(rng.choice(game.open_columns())))
+    results.append(result("check_board", lambda a: game.check_board(), repeat, **params))
+    return results
+
+def bench_render(cols, depth, seed, repeat):
+    from QonnectFour import QonnectFour # imports the notebook front-end only when asked to
+    seed = playable_seed(cols, depth, seed)
+    params = dict(columns = cols, depth = depth, seed = seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = QonnectFour(cols, seed, depth, views = "none")
+    results = []
+    for v in disp_names:
+        def setup():
+            game.renderer.mark([v])
+        try:
+            results.append(result(disp_names[v], lambda a: game.renderer.draw(game.renderer.snapshot([v])), repeat, setup, **params))
+        except ImportError as e: # qiskit or matplotlib missing
+            results.append(dict(name = disp_names[v], skipped = str(e), **params))
+    return results
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def bench_network(repeat):
+    from Network import Network
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py"),
+                               "--host", "127.0.0.1", "--port", str(port), "--quiet"], stdout = subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 10
+        while True:
+            try:
+                net = Network("127.0.0.1", "bench", 1, port)
+                break
+            except ConnectionRefusedError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        net.send(Protocol.SEED, (721, 2, 7, 0))
+        move = [0, 1, "measure", 3, -1, -1, -1, 1, -1, -1, -1]
+        results = [result("round_trip", lambda a: net.send(Protocol.MOVE, move), repeat, kind = "move"),
+                   result("round_trip", lambda a: net.send(Protocol.GET_MOVE, 1), repeat, kind = "get_move")]
+        net.send(Protocol.BYE)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def run(columns, depths, seed = 721, repeat = 50, render_repeat = 5, selected = groups):
+    results = []
+    for cols in columns:
+        for depth in depths:
+            if "engine" in selected:
+                results += bench_engine(cols, depth, seed, repeat)
+            if "render" in selected:
+                results += bench_render(cols, depth, seed, render_repeat)
+    if "network" in selected:
+        results += bench_network(repeat)
+    return {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": commit(), "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "results": results}
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def key(record):
+    return tuple((k, record[k]) for k in ["name", "gate", "kind", "columns", "depth"] if k in record)
+
+def compare(report, baseline, tolerance):
+    # results whose median got slower than the baseline's by more than tolerance (0.2 is 20%)
+    old = dict((key(r), r) for r in baseline["results"] if "median_ms" in r)
+    slower = []
+    for r in report["results"]:
+        b = old.get(key(r))
+        if b is None or "median_ms" not in r:
+            continue
+        if r["median_ms"] > b["median_ms"]*(1 + tolerance):
+            slower.append(dict(r, baseline_ms = b["median_ms"], ratio = r["median_ms"]/b["median_ms"]))
+    return slower
+
+def int_range(text):
+    # "7", "4-14" or "4,7,10"
+    values = []
+    for part in text.split(","):
+        if "-" in part:
+            a, b = part.split("-")
+            values += list(range(int(a), int(b) + 1))
+        else:
+            values.append(int(part))
+    return values
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Qonnect Four benchmarks")
+    parser.add_argument("--columns", type = int_range, default = int_range("4-14"), help = "e.g. 7, 4-14 or 4,7,10")
+    parser.add_argument("--depth", type = int_range, default = [1, 2])
+    parser.add_argument("--seed", type = int, default = 721)
+    parser.add_argument("--repeat", type = int, default = 50, help = "timed calls per engine and network benchmark")
+    parser.add_argument("--render-repeat", type = int, default = 5, help = "timed calls per renderer")
+    parser.add_argument("--only", nargs = "+", choices = groups, default = groups)
+    parser.add_argument("--out", default = None, help = "JSON file to write (default: print)")
+    parser.add_argument("--compare", default = None, help = "JSON of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "allowed slow down of the median, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    report = run(args.columns, args.depth, args.seed, args.repeat, args.render_repeat, args.only)
+    if args.out is None:
+        json.dump(report, sys.stdout, indent = 1)
+        print()
+    else:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent = 1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            slower = compare(report, json.load(f), args.tolerance)
+        for r in slower:
+            print("Slower: " + " ".join(str(k) + "=" + str(v) for k, v in key(r)) +
+                  " %.3f ms (was %.3f ms)" % (r["median_ms"], r["baseline_ms"]), file = sys.stderr)
+        if slower:
+            sys.exit(1)
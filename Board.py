@@ -0,0 +1,66 @@
+class Bitboard:
+    # one integer per player (coin 0/1), bit x*(rows + 1) + h is set if that player has a coin in column x at height h
+    # (counted from the bottom). The extra bit on top of each column is never set, so lines cannot wrap between columns.
+    def __init__(self, cols, rows = None):
+        self.cols = cols
+        self.rows = cols if rows is None else rows
+        self.stride = self.rows + 1
+        # vertical, horizontal, diagonal, antidiagonal
+        self.directions = [1, self.stride, self.stride + 1, self.stride - 1]
+        self.players = [0, 0]
+
+    def position(self, x, h):
+        return int(x)*self.stride + int(h) # python ints, numpy ones would overflow past 64 bits
+
+    def place(self, x, h, player):
+        self.players[player] |= 1 << self.position(x, h)
+
+    def wins_at(self, x, h, player):
+        # only looks at the four lines through (x, h)
+        b = self.players[player]
+        pos = self.position(x, h)
+        for d in self.directions:
+            count = 1
+            p = pos + d
+            while count < 4 and (b >> p) & 1:
+                count += 1
+                p += d
+            p = pos - d
+            while count < 4 and p >= 0 and (b >> p) & 1:
+                count += 1
+                p -= d
+            if count >= 4:
+                return True
+        return False
+
+    def would_win(self, x, h, player):
+        # wins_at as if player also had a coin at (x, h)
+        saved = self.players[player]
+        self.players[player] |= 1 << self.position(x, h)
+        win = self.wins_at(x, h, player)
+        self.players[player] = saved
+        return win
+
+    def wins(self, player):
+        # whole board check, four in a row along d survives three shift-and-masks
+        b = self.players[player]
+        for d in self.directions:
+            m = b & (b >> d)
+            if m & (m >> 2*d):
+                return True
+        return False
+
+if __name__ == "__main__":
+    # regression check: an 8 column board has coins at bit 63 and above, placed with numpy heights as the game does
+    import numpy as np
+    heights = np.zeros(8, dtype=int)
+    board = Bitboard(8)
+    for x in [7, 6, 5]:
+        board.place(np.int64(x), heights[x], 0)
+    assert board.players[0] >> 63 == 1 and not board.wins(0) and not board.wins_at(np.int64(7), heights[7], 0)
+    board.place(np.int64(4), heights[4], 0)
+    assert board.wins(0) and board.wins_at(np.int64(7), heights[7], 0)
+    for h in range(4):
+        board.place(np.int64(7), np.int64(h + 1), 1)
+    assert board.players[1] > 0 and board.wins(1) and board.wins_at(np.int64(7), np.int64(4), 1)
+    print("ok")
@@ -0,0 +1,143 @@
+import weakref
+
+import numpy as np
+
+import Simulator
+from Simulator import QuantumState
+
+# Checkpoints of a game in a bounded ring of preallocated arrays, to undo moves, go back to any kept checkpoint
+# and branch new games off one. Taking a checkpoint copies the statevector, board and coins into a free slot
+# (the oldest checkpoint's once the ring is full); nothing else is copied:
+#  - the history of moves is shared. A checkpoint keeps the game's history list and its length, and is never truncated,
+#    a restored or branched game only makes its own list (of the same moves) once it would go a different way than it.
+#  - a branch reads the checkpoint's statevector, read only, until its first move copies it (QuantumState.own).
+
+def game_budget(game, budget = None):
+    # bytes the game may use, None for no limit
+    if budget is None:
+        budget = game.budget if game.budget is not None else Simulator.memory_budget
+    return budget
+
+def fits(game, budget = None):
+    # how many checkpoints fit in the budget next to the game's own statevector, None for any number
+    budget = game_budget(game, budget)
+    if budget is None:
+        return None
+    return max(budget//game.state.amplitudes.nbytes - 1, 0)
+
+class Checkpoints:
+    def __init__(self, game, size = 32, budget = None):
+        cols = game.columns
+        dtype = game.state.amplitudes.dtype
+        #the ring and the game's own statevector against the game's budget
+        need = (size + 1)*2**cols*np.dtype(dtype).itemsize
+        budget = game_budget(game, budget)
+        if budget is not None and need > budget:
+            raise MemoryError("%d checkpoints of a board with %d columns need %d MiB, more than the budget of %d MiB"
+                              % (size, cols, need//2**20, budget//2**20))
+        self.game = game
+        self.size = size
+        self.states = np.empty((size, 2**cols), dtype=dtype)
+        self.boards = np.empty((size, cols, cols), dtype=game.board.dtype)
+        self.coins = np.empty((size, cols), dtype=game.coin_array.dtype)
+        self.info = [None]*size # turn, move number, winner, bitboard, history list and its length, marginals
+        self.sharing = [weakref.WeakSet() for a in range(size)] # states of branches still reading each slot
+        self.ids = [] # kept checkpoints, oldest first
+        self.slots = {} # id -> slot
+        self.free = list(range(size - 1, -1, -1))
+        self.next_id = 0
+        self.at = -1 # checkpoint the game was last taken at or restored to
+
+    def __len__(self):
+        return len(self.ids)
+
+    def slot(self, id):
+        if id not in self.slots:
+            raise ValueError("No checkpoint " + str(id) + ", the ring keeps " + str(self.ids))
+        return self.slots[id]
+
+    def unchanged(self, id):
+        # no move since the game was at checkpoint id, every move adds to the history
+        turn, move_no, winner, players, history, length, cache = self.info[self.slot(id)]
+        return self.at == id and len(self.game.history) == length and self.game.move_no == move_no
+
+    def take(self):
+        #checkpoint of the game as it is now, returns its id
+        game = self.game
+        if self.ids and self.unchanged(self.ids[-1]):
+            return self.ids[-1]
+        if not self.free:
+            self.free.append(self.slots.pop(self.ids.pop(0)))
+        slot = self.free.pop()
+        for state in list(self.sharing[slot]): # about to be overwritten
+            state.own()
+        self.sharing[slot] = weakref.WeakSet()
+
+        self.states[slot] = game.state.data
+        self.boards[slot] = game.board
+        self.coins[slot] = game.coin_array
+        self.info[slot] = (game.turn, game.move_no, game.winner, list(game.bitboard.players),
+                           game.history, len(game.history), game.state.cache)
+        id = self.next_id
+        self.next_id += 1
+        self.ids.append(id)
+        self.slots[id] = slot
+        self.at = id
+        return id
+
+    def history(self, slot, current = None):
+        # the checkpoint's history for a game whose history is current: the list itself while nothing was added
+        # to it since, otherwise a new list of its first moves
+        turn, move_no, winner, players, history, length, cache = self.info[slot]
+        if current is history and len(history) == length:
+            return history
+        return history[:length]
+
+    def restore(self, id):
+        #puts the game back to checkpoint id, the checkpoints after it are kept (restore one of them to redo)
+        slot = self.slot(id)
+        game = self.game
+        turn, move_no, winner, players, history, length, cache = self.info[slot]
+        game.state.set(self.states[slot])
+        game.state.cache = cache
+        game.board[:] = self.boards[slot]
+        game.coin_array[:] = self.coins[slot]
+        game.bitboard.players = list(players)
+        game.turn, game.move_no, game.winner = turn, move_no, winner
+        game.history = self.history(slot, game.history)
+        game.qc = None # drawn again from the history when asked for
+        game.qc_len = 0
+        self.at = id
+        return game
+
+    def undo(self):
+        #goes back to the last checkpoint and forgets it, or to the one before if the game has not moved since
+        #(it was taken or restored by hand). Returns the id gone back to
+        if self.ids and self.unchanged(self.ids[-1]):
+            self.free.append(self.slots.pop(self.ids.pop()))
+        if not self.ids:
+            raise ValueError("Nothing to undo")
+        id = self.ids[-1]
+        self.restore(id)
+        self.free.append(self.slots.pop(self.ids.pop()))
+        self.at = -1
+        return id
+
+    def branch(self, id):
+        #a new headless Engine at checkpoint id, the game itself is not touched
+        slot = self.slot(id)
+        game = self.game
+        turn, move_no, winner, players, history, length, cache = self.info[slot]
+        data = self.states[slot].view()
+        data.flags.writeable = False
+        state = QuantumState(game.columns, data, dtype = data.dtype, copy = False)
+        state.rng = game.state.rng
+        state.cache = cache
+        self.sharing[slot].add(state)
+        branch = game.fork(state)
+        branch.board[:] = self.boards[slot]
+        branch.coin_array[:] = self.coins[slot]
+        branch.bitboard.players = list(players)
+        branch.turn, branch.move_no, branch.winner = turn, move_no, winner
+        branch.history = self.history(slot)
+        return branch
@@ -0,0 +1,131 @@
+import threading
+
+import numpy as np
+
+from Board import Bitboard
+from Network import Network
+import Protocol
+
+# Clients that follow a game from the moves the server sends, without simulating it themselves.
+# ThinClient plays in a room whose game the server hosts (see Room.play in Server.py): moves go to the server,
+# which checks and applies them on its own Engine and sends everyone the coins they placed. Spectator watches any
+# room: it gets a snapshot of the game (seed, depth, columns and the moves so far) and then each new move once.
+# Only the board is kept, so neither needs qiskit or the simulator (a Spectator can rebuild the state if asked to).
+
+class View:
+    # board of a game built from moves [player, move number, move, positions...] as sent by the server
+    def __init__(self, seed, depth, cols, StartPlayer):
+        self.seed = seed
+        self.depth = depth
+        self.columns = cols
+        self.turn = StartPlayer # the host moves first
+        self.winner = -1
+
+        #board with initial flags of -1, board[x][y] is column x and row y counted from the top (as in Engine)
+        self.board = np.full((cols, cols), -1, dtype=int)
+        self.coin_array = np.array([0]*cols)
+        self.bitboard = Bitboard(cols)
+        self.moves = [] # every move so far
+
+        self.lock = threading.Lock() # pushed moves are applied on the network thread
+
+    def expect(self, reply):
+        kind, value = reply
+        if kind == Protocol.ERROR:
+            raise ConnectionError(value)
+        return value
+
+    def over(self):
+        return self.winner != -1 or (self.coin_array == self.columns).all()
+
+    def place(self, move):
+        #coins of a measurement, the measured column then the others it collapsed
+        if move[2] != "measure":
+            return
+        outcomes = move[4:]
+        positions = [move[3]] + [a for a in range(self.columns) if outcomes[a] in [0, 1] and a != move[3]]
+        for x in positions:
+            self.coin_array[x] += 1
+            self.board[x][self.columns - self.coin_array[x]] = outcomes[x]
+            self.bitboard.place(x, self.coin_array[x] - 1, outcomes[x])
+        for x in positions:
+            if self.bitboard.wins_at(x, self.coin_array[x] - 1, outcomes[x]):
+                self.winner = outcomes[x]
+                break
+
+    def close(self):
+        self.net.send(Protocol.BYE)
+        self.net.client.close()
+
+class ThinClient(View):
+    def __init__(self, IP, room = "default", create = 0, port = 5555, seed = 721, depth = 2, cols = 7, StartPlayer = 0, on_move = None):
+        self.net = Network(IP, room, create, port)
+        if create: # the host picks the game, the server plays it
+            self.expect(self.net.send(Protocol.HOST))
+            self.expect(self.net.send(Protocol.SEED, (seed, depth, cols, StartPlayer)))
+            self.player = StartPlayer
+        else:
+            seed, depth, cols, StartPlayer = self.expect(self.net.send(Protocol.SEED_WANT))
+            self.player = 1 - StartPlayer
+        View.__init__(self, seed, depth, cols, StartPlayer)
+        self.move_no = 0
+        self.on_move = on_move # called with each move of the opponent after it has been applied
+        self.net.subscribe(self.receive)
+
+    def play(self, gate, args = []):
+        #sends a (gate or "measure", columns) move, raises ValueError with the server's reason if it is refused
+        kind, value = self.net.send(Protocol.PLAY, [self.player, self.move_no, gate] + [int(a) for a in args])
+        if kind != Protocol.MOVE:
+            raise ValueError(value)
+        self.apply(value)
+        return value
+
+    def measure(self, col):
+        return self.play("measure", [col])
+
+    def receive(self, move):
+        if self.apply(move) and self.on_move is not None:
+            self.on_move(move)
+
+    def apply(self, move):
+        #places the coins of a move as applied by the server, returns False if it was already applied
+        with self.lock:
+            if move[1] <= self.move_no:
+                return False
+            self.place(move)
+            self.moves.append(move)
+            self.move_no = move[1]
+            self.turn = 1 - move[0]
+        return True
+
+class Spectator(View):
+    # follows a room's game; with state = 1 it also replays the moves on an Engine (numpy only) to have the statevector
+    def __init__(self, IP, room = "default", port = 5555, state = 0, on_move = None):
+        self.net = Network(IP, room, 0, port, watch = 1)
+        seed, depth, cols, StartPlayer, self.logged = self.net.snapshot # logged: moves made before we joined, pushed next
+        View.__init__(self, seed, depth, cols, StartPlayer)
+        self.game = None
+        if state:
+            from Engine import Engine
+            self.game = Engine(cols, seed, depth, StartPlayer)
+        self.on_move = on_move # called with each new move once it has been applied, not with the ones before joining
+        self.net.listen(self.receive)
+
+    def receive(self, move):
+        with self.lock:
+            self.place(move)
+            if self.game is not None:
+                if move[2] == "measure":
+                    self.game.replay_measure(move[3:])
+                else:
+                    self.game.apply_gate(move[2], move[3:])
+                self.game.move_no += 1
+                self.game.turn = 1 - move[0]
+                self.game.winner = self.winner
+            self.moves.append(move)
+            self.turn = 1 - move[0]
+        if self.on_move is not None and len(self.moves) > self.logged:
+            self.on_move(move)
+
+    def caught_up(self):
+        return len(self.moves) >= self.logged
@@ -0,0 +1,382 @@
+import numpy as np
+
+import Simulator
+from Simulator import QuantumState
+from Board import Bitboard
+import Trace
+import Initial
+from Checkpoint import Checkpoints
+from Initial import gates
+gate_sizes = {"cx": 2, "ccx": 3} # number of qubits of each gate, 1 if not listed
+
+class Engine:
+    # Game state and rules without any display or networking: statevector, board, coins and win check.
+    # Only numpy is imported; the qiskit circuit is built on first use of self.circuit.
+    def __init__(self, cols, seed, depth = 2, StartPlayer = 0, state = None, dtype = complex, budget = None):
+        self.columns = cols
+        self.depth = depth
+        self.seed = seed
+        self.turn = StartPlayer
+        self.move_no = 0
+        self.winner = -1 # player with four in a row, once there is one
+        self.ready = 0
+        #statevector precision, np.complex64 halves the memory of big boards; checked against the budget
+        #(Simulator.memory_budget unless given) before anything is allocated, checkpoints count against it too
+        self.dtype = dtype
+        self.budget = budget
+        Simulator.check_memory(cols, dtype, budget)
+        self.tracer = Trace.null # times the phases of each move once instrument() is called
+        self.checkpoints = None # taken before every move once keep_checkpoints() is called
+
+        #board with initial flags of -1, board[x][y] is column x and row y counted from the top
+        self.board = np.full((cols, cols), -1, dtype=int)
+        self.coin_array = np.array([0]*cols)
+        self.bitboard = Bitboard(cols)
+
+        #moves applied so far as (gate/"measure"/"barrier", qubits), the circuit is drawn from this
+        self.history = []
+        self.qc = None
+        self.qc_len = 0
+        self.initial = None
+
+        #pseudo-random initial circuit and corresponding statevector, copied from the cache after the first game on a seed.
+        #Or start from a given statevector (a saved one, the history then starts from it)
+        if state is None:
+            self.initial = Initial.cache.get(cols, seed, depth, dtype)
+            if self.initial.error is not None:
+                raise ValueError(self.initial.error)
+            self.state = QuantumState(cols, self.initial.state, dtype = dtype, copy = self.initial.cached)
+            if not self.initial.cached:
+                self.initial.state = None
+            self.history = [(gate, list(args)) for gate, args in self.initial.history]
+        else:
+            self.state = QuantumState(cols, state, dtype = dtype)
+        self.ready = 1
+
+    @property
+    def circuit(self):
+        #qiskit circuit of the history, only imports qiskit and appends the new part when asked for
+        from qiskit import QuantumCircuit
+        if self.qc is None or self.qc_len > len(self.history):
+            if self.initial is not None and len(self.history) >= len(self.initial.history):
+                self.qc = self.initial.circuit().copy()
+                self.qc_len = len(self.initial.history)
+            else:
+                self.qc = QuantumCircuit(self.columns, self.columns)
+                self.qc_len = 0
+        for name, args in self.history[self.qc_len:]:
+            if name == "measure":
+                self.qc.measure(args, args)
+            else:
+                getattr(self.qc, name)(*args)
+        self.qc_len = len(self.history)
+        return self.qc
+
+    def instrument(self, *sinks):
+        #records the time of each phase of every move and passes the records to the sinks (see Trace.py),
+        #no sinks turns it off again
+        self.tracer.close()
+        self.tracer = Trace.Tracer(sinks) if sinks else Trace.null
+
+    def keep_checkpoints(self, size = 32):
+        #a checkpoint before every move from now on, in a ring of the last size (see Checkpoint.py); 0 to stop
+        self.checkpoints = Checkpoints(self, size) if size else None
+        return self.checkpoints
+
+    def undo(self):
+        #takes back the last move, returns the id of the checkpoint gone back to
+        if self.checkpoints is None:
+            raise ValueError("No checkpoints to go back to, call keep_checkpoints() first")
+        return self.checkpoints.undo()
+
+    def pass_turn(self):
+        self.turn = 1 - self.turn
+
+    def over(self):
+        return self.winner != -1 or (self.coin_array == self.columns).all()
+
+    def open_columns(self):
+        return [a for a in range(self.columns) if self.coin_array[a] < self.columns]
+
+    def legal_moves(self):
+        #every move the player to move can make, as (gate or "measure", qubits)
+        cols = self.open_columns()
+        moves = [("measure", [a]) for a in cols]
+        for gate in gates:
+            size = gate_sizes.get(gate, 1)
+            if size == 1:
+                moves += [(gate, [a]) for a in cols]
+            elif size == 2:
+                moves += [(gate, [a, b]) for a in cols for b in cols if a != b]
+            else:
+                moves += [(gate, [a, b, c]) for a in cols for b in cols for c in cols if len(set([a, b, c])) == 3]
+        return moves
+
+    def play(self, move, outcome = None):
+        #plays a (gate or "measure", qubits) move for the player to move and passes the turn.
+        #A measurement is random unless its outcome is given. Returns the (positions, results) of a measurement, ([], []) for a gate.
+        name, args = move
+        if name == "measure":
+            self.check_column(args[0])
+        else:
+            self.check_gate(name, args)
+        if self.checkpoints is not None: # only once the move is known to be valid
+            self.checkpoints.take()
+        self.tracer.begin(name, args = list(args), player = self.turn, move_no = self.move_no)
+        try:
+            if name == "measure":
+                if outcome is None:
+                    positions, results = self.measure_column(args[0])
+                else:
+                    positions, results = self.measure_outcome(args[0], outcome)
+                end, player = self.check_coins(positions)
+                self.tracer.mark("win_check")
+                if end:
+                    self.winner = player
+            else:
+                self.apply_gate(name, args)
+                positions, results = [], []
+        finally:
+            self.tracer.end()
+        self.move_no += 1
+        self.pass_turn()
+        return positions, results
+
+    def check_column(self, a):
+        if not isinstance(a, (int, np.integer)):
+            raise ValueError("Invalid input! Provide an integer for position number")
+        if a < 0 or a >= self.columns:
+            raise ValueError("Column out of bounds! Enter value between 0 and " + str(self.columns - 1))
+        if self.coin_array[a] == self.columns:
+            raise ValueError("Column full, try different move")
+
+    def check_gate(self, gate, args):
+        if gate not in gates or len(args) != gate_sizes.get(gate, 1):
+            raise ValueError("Invalid gate " + str(gate) + " on " + str(list(args)) + ", choose from " + str(gates))
+        for a in args:
+            self.check_column(a)
+        if len(set(args)) != len(args):
+            raise ValueError("Gate qubits must be different columns")
+
+    def apply_gate(self, gate, args):
+        #raises ValueError without changing anything if the gate can't be played
+        self.check_gate(gate, args)
+        args = [int(a) for a in args]
+        self.tracer.mark("validation")
+        self.history.append((gate, args))
+        self.state.apply(gate, args)
+        self.tracer.mark("evolution")
+
+    def check_pure(self):
+        #uses the state's cached marginals, recomputed only after a gate or measurement
+        p0 = self.state.marginals()[:, 0]
+        pure = np.isclose(p0, 0.0, 1e-3) | np.isclose(p0, 1.0, 1e-3)
+        return [int(a) for a in pure]
+
+    def measure_column(self, qubit_pos):
+        #measures a column and collapses any qubit made pure by it, places the coins and returns (positions, results)
+        self.check_column(qubit_pos)
+        qubit_pos = int(qubit_pos)
+        self.tracer.mark("validation")
+        self.state.sync() # gates are queued until the state is needed
+        self.tracer.mark("evolution")
+
+        #get premeasurement pure states
+        pure_before = self.check_pure()
+        self.tracer.mark("purity")
+
+        #perform measurement
+        result = self.state.measure([qubit_pos])
+        self.history.append(("measure", [qubit_pos]))
+        self.history.append(("barrier", []))
+        self.tracer.mark("collapse")
+
+        #check if any other qubits collapsed to pure due to measurement
+        pure_after = self.check_pure()
+        self.tracer.mark("purity")
+
+        positions = [qubit_pos]
+        results = [result]
+
+        #collapse all newly pure qubits together, the opponent replays this with a single projection
+        extras = [a for a in range(self.columns) if pure_after[a] == 1 and pure_before[a] == 0 and a != qubit_pos]
+        if extras:
+            res_extra = self.state.measure(extras)
+            for b in range(len(extras)):
+                positions.append(extras[b])
+                results.append((res_extra >> b) & 1)
+            self.tracer.mark("collapse")
+
+        self.place(positions, results)
+        self.tracer.mark("board")
+        return positions, results
+
+    def measure_outcome(self, qubit_pos, outcome):
+        #measure_column with the given outcome instead of a random one, newly pure columns take their likely value
+        self.check_column(qubit_pos)
+        qubit_pos = int(qubit_pos)
+        pure_before = self.check_pure()
+        self.state.project([qubit_pos], [outcome])
+        self.history.append(("measure", [qubit_pos]))
+        self.history.append(("barrier", []))
+        pure_after = self.check_pure()
+
+        positions = [qubit_pos]
+        results = [outcome]
+        extras = [a for a in range(self.columns) if pure_after[a] == 1 and pure_before[a] == 0 and a != qubit_pos]
+        if extras:
+            values = [int(self.state.marginals()[a, 1] > 0.5) for a in extras]
+            self.state.project(extras, values)
+            positions += extras
+            results += values
+
+        self.place(positions, results)
+        return positions, results
+
+    def replay_measure(self, qubit_pos):
+        #applies a measurement given as [measured column, outcome of each column (-1 if not collapsed)],
+        #raises ValueError without changing anything if it can't be one
+        if len(qubit_pos) != self.columns + 1:
+            raise ValueError("A measurement is the column and an outcome for each of the " + str(self.columns) + " columns")
+        temp2 = qubit_pos[1:(self.columns+1)]
+        self.check_column(qubit_pos[0])
+        if temp2[qubit_pos[0]] not in [0, 1]:
+            raise ValueError("No outcome for the measured column " + str(qubit_pos[0]))
+        extras = [a for a in range(self.columns) if temp2[a] in [0, 1] and a != qubit_pos[0]]
+        for a in extras:
+            self.check_column(a)
+        positions = [qubit_pos[0]] + extras
+        results = [temp2[a] for a in positions]
+        self.state.sync()
+        self.tracer.mark("evolution")
+
+        #the outcomes must be possible, with the extras (a second pass over the state) only if there are any
+        possible = self.state.outcome_probabilities(positions[:1])[results[0]] > 0
+        if possible and extras:
+            possible = self.state.probabilities(positions)[sum(v << i for i, v in enumerate(results))] > 0
+        if not possible:
+            raise ValueError("Outcome " + str(results) + " on columns " + str(positions) + " has zero probability")
+        self.tracer.mark("validation")
+        self.history.append(("measure", [qubit_pos[0]]))
+        self.history.append(("barrier", []))
+
+        #project onto the opponent's outcomes instead of re-measuring until they match
+        self.state.project(positions[:1], results[:1])
+        if extras:
+            self.state.project(extras, results[1:])
+        self.tracer.mark("collapse")
+
+        self.place(positions, results)
+        self.tracer.mark("board")
+        return positions, results
+
+    def outcomes(self):
+        #what measuring each column would do, worked out from the pair marginals of the state (one pass over |psi|^2)
+        #without touching the game. For column a and outcome o: p[a, o] its probability, collapsed[a, o] the outcome of
+        #every column it would collapse (-1 if not; measure_column's rule, newly pure columns taking their likely value),
+        #winner[a, o] the player with four in a row afterwards (-1 for none) and win[a, player] the chance measuring a wins.
+        #Full columns and outcomes with probability below 1e-12 collapse nothing and win nothing.
+        cols = self.columns
+        joint = self.state.pair_marginals()
+        p = joint[np.arange(cols), np.arange(cols)][:, [0, 1], [0, 1]]
+        pure_before = np.array(self.check_pure(), dtype=bool)
+
+        #P(column b = 0 | column a = o) and whether b is pure then, as check_pure decides it
+        given = np.maximum(p, 1e-300)[:, :, None]
+        p0 = joint[:, :, :, 0].transpose(0, 2, 1)/given
+        p1 = joint[:, :, :, 1].transpose(0, 2, 1)/given
+        pure_after = np.isclose(p0, 0.0, 1e-3) | np.isclose(p0, 1.0, 1e-3)
+        extras = pure_after & ~pure_before & ~np.eye(cols, dtype=bool)[:, None, :]
+
+        collapsed = np.full((cols, 2, cols), -1)
+        winner = np.full((cols, 2), -1)
+        board = Bitboard(cols)
+        for a in self.open_columns():
+            for o in range(2):
+                if p[a, o] < 1e-12:
+                    continue
+                positions = [a] + [int(x) for x in np.flatnonzero(extras[a, o])]
+                results = [o] + [int(p1[a, o, x] > 0.5) for x in positions[1:]]
+                collapsed[a, o, positions] = results
+                #check_coins on a copy of the bitboard
+                board.players = list(self.bitboard.players)
+                for x, r in zip(positions, results):
+                    board.place(x, self.coin_array[x], r)
+                for x, r in zip(positions, results):
+                    if board.wins_at(x, self.coin_array[x], r):
+                        winner[a, o] = r
+                        break
+        win = np.stack([(p*(winner == player)).sum(axis=1) for player in range(2)], axis=1)
+        return {"p": p, "collapsed": collapsed, "winner": winner, "win": win}
+
+    def outcome_list(self, positions, results):
+        #measurement in the form replay_measure takes
+        temp = [-1]*self.columns
+        for a in range(len(positions)):
+            temp[positions[a]] = results[a]
+        return [positions[0]] + temp # so we can mark where measurement was performed
+
+    def place(self, positions, results):
+        for a in range(len(positions)):
+            x = positions[a]
+            self.coin_array[x] += 1
+            self.board[x][self.columns - self.coin_array[x]] = results[a]
+            self.bitboard.place(x, self.coin_array[x] - 1, results[a])
+
+    def save(self):
+        #everything a move changes, restore() goes back to it; much cheaper than copying the whole game
+        if Simulator.counting:
+            Simulator.allocated(1, self.state.data.nbytes)
+        return (self.state.data.copy(), self.state.cache, self.board.copy(), self.coin_array.copy(), list(self.bitboard.players),
+                self.turn, self.move_no, self.winner, len(self.history))
+
+    def restore(self, saved):
+        #a saved position can be restored any number of times
+        data, cache, board, coins, players, self.turn, self.move_no, self.winner, length = saved
+        self.state.set(data)
+        self.state.cache = cache
+        self.board[:] = board
+        self.coin_array[:] = coins
+        self.bitboard.players = list(players)
+        if self.checkpoints is not None: # they may still need the moves after length
+            self.history = self.history[:length]
+        else:
+            del self.history[length:]
+        if self.qc_len > length: # the circuit has moves that were taken back
+            self.qc = None
+
+    def fork(self, state = None):
+        #headless copy of the game with nothing mutable shared, for trying out moves (on state instead of a copy if given)
+        game = Engine.__new__(Engine)
+        game.__dict__.update(columns = self.columns, depth = self.depth, seed = self.seed, turn = self.turn,
+                             move_no = self.move_no, winner = self.winner, ready = self.ready, dtype = self.dtype, budget = self.budget,
+                             board = self.board.copy(), coin_array = self.coin_array.copy(),
+                             bitboard = Bitboard(self.columns), history = list(self.history), qc = None, qc_len = 0,
+                             state = self.state.copy() if state is None else state, tracer = Trace.null,
+                             initial = self.initial, checkpoints = None)
+        game.bitboard.players = list(self.bitboard.players)
+        if state is None:
+            game.state.cache = self.state.cache
+        return game
+
+    def check_board(self):
+        for player in range(2):
+            if self.bitboard.wins(player):
+                return True, player
+        return False, -1
+
+    def check_coins(self, positions):
+        #only the lines through the top coin of each given column can have changed
+        for x in positions:
+            h = self.coin_array[x] - 1
+            player = int(self.board[x][self.columns - 1 - h])
+            if self.bitboard.wins_at(x, h, player):
+                return True, player
+        return False, -1
+
+    def generate_random(self):
+        #applies the seed's initial circuit gate by gate (new games copy the cached result instead, see Initial.py)
+        for gate, args in Initial.Program(self.columns, self.seed, self.depth):
+            self.apply_gate(gate, list(args))
+        self.history.append(("barrier", []))
+        return
@@ -0,0 +1,158 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from Simulator import QuantumState
+
+# The pseudo-random initial circuit of a game and its statevector, which only depend on (seed, depth, columns).
+# They are kept in an LRU cache (and optionally in a directory), so starting another game on a known seed copies
+# the statevector instead of simulating the circuit again.
+
+gates = ["h", "z", "x", "y", "s", "t", "cx", "ccx"]
+
+class Program:
+    # the initial circuit as a tuple of (gate, qubits), read from the seed's digits with a cursor
+    def __init__(self, cols, seed, depth):
+        self.columns = cols
+        self.seed = seed
+        self.depth = depth
+        self.gates = tuple(self.generate())
+
+    def sequence(self):
+        seed_digits = [int(d) for d in str(bin((self.seed + 500)**3))[2:]]
+        seed_digits = seed_digits[:(len(seed_digits) - (len(seed_digits)%3))]
+        sequence = [4*seed_digits[3*a] + 2*seed_digits[3*a + 1] + seed_digits[3*a + 2] for a in range(len(seed_digits)//3)]
+
+        #the sequence is extended from itself as it grows, each round doubles it (as the original list aliasing did)
+        number = self.depth*self.columns*3
+        if len(sequence) < number:
+            for a in range(int(number/len(sequence))):
+                sequence += [int((d + self.seed*a)%8) for d in sequence]
+        return sequence
+
+    def generate(self):
+        sequence = self.sequence()
+        cols = self.columns
+        i = 0 # cursor into the sequence
+        for d in range(self.depth):
+            for a in range(cols):
+                if sequence[i] <= 5:
+                    yield gates[sequence[i]], (a,)
+                    i += 1
+                elif sequence[i] == 6:
+                    b = sequence[i + 1]%cols - int(a == sequence[i + 1]%cols)
+                    yield "cx", (a, b%cols) # b can be -1, the last column (as qiskit indexes it)
+                    i += 2
+                else:
+                    b = sequence[i + 1]%cols - int(a == sequence[i + 1]%cols)
+                    c = sequence[i + 2]%cols
+                    c = c - int(c==a) - int(((c - int(c==a)) == b))
+                    yield "ccx", (a, b%cols, c%cols)
+                    i += 3
+
+    def __iter__(self):
+        return iter(self.gates)
+
+    def __len__(self):
+        return len(self.gates)
+
+class Start:
+    # statevector (read only once cached) and circuit of a program, or why it can't be played
+    def __init__(self, program, state = None, error = None):
+        self.program = program
+        self.state = state
+        self.error = error
+        self.cached = False # starts too big for the cache are handed to a single game, which takes the statevector over
+        self.history = tuple((gate, list(args)) for gate, args in program) + (("barrier", []),)
+        self.qc = None
+
+    def circuit(self):
+        #qiskit circuit of the history, drawn once and copied by each game
+        if self.qc is None:
+            from qiskit import QuantumCircuit
+            qc = QuantumCircuit(self.program.columns, self.program.columns)
+            for name, args in self.history:
+                getattr(qc, name)(*args)
+            self.qc = qc
+        return self.qc
+
+def simulate(program, dtype = complex):
+    state = QuantumState(program.columns, dtype = dtype)
+    for gate, args in program:
+        if len(set(args)) != len(args):
+            raise ValueError("Gate qubits must be different columns")
+        state.apply(gate, list(args))
+    return state.data
+
+class Cache:
+    def __init__(self, size = 128, directory = None, max_bytes = 2**28):
+        self.size = size
+        self.max_bytes = max_bytes # statevectors kept in memory at most, bigger ones are not cached
+        self.bytes = 0
+        self.directory = directory # statevectors are also saved here as .npy, None to keep them in memory only
+        self.starts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def persist(self, directory):
+        if directory is not None:
+            os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+
+    def path(self, key):
+        name = "%d_%d_%d" % key[:3]
+        if key[3] != "complex128":
+            name += "_" + key[3]
+        return os.path.join(self.directory, name + ".npy")
+
+    def load(self, key, program):
+        if self.directory is not None and os.path.exists(self.path(key)):
+            state = np.load(self.path(key))
+            if state.shape == (2**program.columns,) and state.dtype == key[3]:
+                return state
+        try:
+            state = simulate(program, key[3])
+        except ValueError as e:
+            return str(e)
+        if self.directory is not None:
+            # written under another name first, so other processes never read half a file
+            temp = self.path(key) + "." + str(os.getpid()) + ".tmp"
+            with open(temp, "wb") as f:
+                np.save(f, state)
+            os.replace(temp, self.path(key))
+        return state
+
+    def get(self, cols, seed, depth, dtype = complex):
+        key = (seed, depth, cols, np.dtype(dtype).name)
+        with self.lock:
+            if key in self.starts:
+                self.starts.move_to_end(key)
+                return self.starts[key]
+        program = Program(cols, seed, depth)
+        state = self.load(key, program)
+        if isinstance(state, str):
+            start = Start(program, error = state)
+        else:
+            start = Start(program, state)
+            if state.nbytes > self.max_bytes:
+                return start
+            state.flags.writeable = False
+            start.cached = True
+        with self.lock:
+            if key not in self.starts:
+                self.starts[key] = start
+                self.bytes += nbytes(start)
+            while len(self.starts) > self.size or self.bytes > self.max_bytes:
+                self.bytes -= nbytes(self.starts.popitem(last = False)[1])
+        return start
+
+    def clear(self):
+        with self.lock:
+            self.starts.clear()
+            self.bytes = 0
+
+def nbytes(start):
+    return 0 if start.state is None else start.state.nbytes
+
+cache = Cache()
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import Protocol
+from Bench import free_port, commit, playable_seed
+from Client import View
+from Trace import percentile
+
+# Load generator for Server.py: many simulated players on one asyncio loop, speaking the same protocol as Network.
+# Each game is a host and a guest doing the room and seed handshake (CREATE + SEED, JOIN + SEED_WANT), then taking
+# turns at a set rate; the other player receives each move by polling GET_MOVE or by having it pushed (SUBSCRIBE).
+# Reports throughput, round trip latency per message kind, push latency, errors, and the server's CPU and memory
+# over time (read from /proc, so Linux only). Everything runs on localhost, the server is started unless --port is given.
+
+#message kinds by number, for the report
+kind_names = dict((getattr(Protocol, n), n) for n in ["CREATE", "JOIN", "SEED", "SEED_WANT", "GET_MOVE", "MOVE",
+                                                      "SUBSCRIBE", "HOST", "PLAY", "STATS"])
+
+class Results:
+    def __init__(self):
+        self.latency = collections.defaultdict(list) # message kind -> seconds from sending it to its reply
+        self.push = [] # seconds from sending a move to the opponent having it, pushed or polled
+        self.messages = 0
+        self.moves = 0
+        self.games = 0 # played to the end or to --moves
+        self.errors = 0 # ERROR replies
+        self.connection_errors = 0
+
+class LoadClient:
+    # one player on an asyncio stream, requests wait for their reply like Network.send
+    def __init__(self, results):
+        self.results = results
+        self.decoder = Protocol.Decoder()
+        self.frames = collections.deque()
+        self.pushed = collections.deque() # moves pushed while waiting for a reply
+        self.writer = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def frame(self):
+        while not self.frames:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            self.frames.extend(self.decoder.feed(data))
+        return self.frames.popleft()
+
+    async def request(self, kind, value = None):
+        start = time.perf_counter()
+        self.writer.write(Protocol.encode(kind, value))
+        reply, payload = await self.frame()
+        while reply == Protocol.PUSH:
+            self.pushed.append(payload)
+            reply, payload = await self.frame()
+        self.results.latency[kind_names[kind]].append(time.perf_counter() - start)
+        self.results.messages += 1
+        value = Protocol.decode_payload(reply, payload)
+        if reply == Protocol.ERROR:
+            self.results.errors += 1
+            raise ValueError(value)
+        return value
+
+    async def push(self):
+        if self.pushed:
+            return Protocol.decode_move(self.pushed.popleft())
+        reply, payload = await self.frame()
+        while reply != Protocol.PUSH:
+            reply, payload = await self.frame()
+        return Protocol.decode_move(payload)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def next_move(view, move_no, rng, hosted):
+    # a random single qubit gate or a measurement of an open column, as PLAY (hosted) or MOVE (relayed) takes it
+    player = view.turn
+    cols = [a for a in range(view.columns) if view.coin_array[a] < view.columns]
+    if rng.random() < 0.5:
+        return [player, move_no, rng.choice(["h", "x", "s", "t"]), rng.choice(cols)]
+    col = rng.choice(cols)
+    if hosted:
+        return [player, move_no, "measure", col]
+    outcomes = [-1]*view.columns
+    outcomes[col] = rng.randrange(2)
+    return [player, move_no, "measure", col] + outcomes
+
+async def play_game(index, options, results):
+    room = "load-%d-%d" % (os.getpid(), index)
+    await asyncio.sleep(options.ramp*index/options.games) # spread the connections out
+    host, guest = LoadClient(results), LoadClient(results)
+    players = [host, guest]
+    rng = random.Random(index)
+    try:
+        await host.connect(options.host, options.port)
+        await host.request(Protocol.CREATE, room)
+        if options.mode == "hosted":
+            await host.request(Protocol.HOST)
+        await host.request(Protocol.SEED, (options.seed, options.depth, options.columns, 0))
+        await guest.connect(options.host, options.port)
+        await guest.request(Protocol.JOIN, room)
+        seed, depth, cols, start = await guest.request(Protocol.SEED_WANT)
+        if options.receive == "push":
+            for p in players:
+                await p.request(Protocol.SUBSCRIBE)
+
+        view = View(seed, depth, cols, start) # host is player 0 and moves first
+        for move_no in range(options.moves):
+            if view.over():
+                break
+            if options.rate:
+                await asyncio.sleep(rng.expovariate(options.rate))
+            player = view.turn
+            me, other = players[player], players[1 - player]
+            move = next_move(view, move_no, rng, options.mode == "hosted")
+            start = time.perf_counter()
+            if options.mode == "hosted":
+                move = await me.request(Protocol.PLAY, move)
+            else:
+                move[1] += 1 # relayed moves are numbered from 1, as QonnectFour does
+                await me.request(Protocol.MOVE, move)
+            if options.receive == "push":
+                received = await other.push()
+            else:
+                received = await other.request(Protocol.GET_MOVE, 1 - player)
+                while received[1] != move[1]:
+                    await asyncio.sleep(options.poll)
+                    received = await other.request(Protocol.GET_MOVE, 1 - player)
+            results.push.append(time.perf_counter() - start)
+            results.moves += 1
+            view.place(move)
+            view.turn = 1 - player
+        results.games += 1
+    except (OSError, ConnectionError, Protocol.ProtocolError):
+        results.connection_errors += 1
+    except ValueError: # an error reply, already counted
+        pass
+    finally:
+        for p in players:
+            p.close()
+
+def sample(pid):
+    # CPU seconds used so far and resident memory in KiB of a process
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12]))/os.sysconf("SC_CLK_TCK") # utime and stime
+    rss = 0
+    with open("/proc/%d/status" % pid) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    return cpu, rss
+
+async def monitor(pid, interval, timeline):
+    start = time.perf_counter()
+    last_time, (last_cpu, rss) = start, sample(pid)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            cpu, rss = sample(pid)
+        except OSError: # the server is gone
+            return
+        now = time.perf_counter()
+        timeline.append({"t": now - start, "cpu_percent": 100*(cpu - last_cpu)/(now - last_time), "rss_kb": rss})
+        last_time, last_cpu = now, cpu
+
+async def wait_for_server(host, port, timeout = 10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+def latency_summary(values):
+    values = sorted(values)
+    return {"count": len(values), "p50_ms": 1000*percentile(values, 0.5), "p99_ms": 1000*percentile(values, 0.99),
+            "max_ms": 1000*values[-1] if values else 0.0}
+
+async def run(options):
+    results = Results()
+    timeline = []
+    await wait_for_server(options.host, options.port)
+    watcher = asyncio.ensure_future(monitor(options.server_pid, options.interval, timeline)) if options.server_pid else None
+    start = time.perf_counter()
+    used = os.times()
+    await asyncio.gather(*[play_game(a, options, results) for a in range(options.games)])
+    duration = time.perf_counter() - start
+    used = os.times()[0] - used[0] + os.times()[1] - used[1]
+    if watcher is not None:
+        watcher.cancel()
+
+    latency = dict((kind, latency_summary(values)) for kind, values in results.latency.items())
+    return {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": commit(), "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": dict((k, v) for k, v in vars(options).items() if k not in ["out", "compare", "tolerance"]),
+            "clients": 2*options.games, "duration_s": duration, "games": results.games, "moves": results.moves,
+            "messages": results.messages, "messages_per_sec": results.messages/duration, "moves_per_sec": results.moves/duration,
+            "latency": latency, "all": latency_summary(sum(results.latency.values(), [])),
+            "move_delivery": latency_summary(results.push), "errors": results.errors,
+            "connection_errors": results.connection_errors, "generator_cpu_percent": 100*used/duration,
+            "server": {"peak_rss_kb": max([s["rss_kb"] for s in timeline], default = 0),
+                       "mean_cpu_percent": sum(s["cpu_percent"] for s in timeline)/len(timeline) if timeline else 0.0,
+                       "timeline": timeline}}
+
+def compare(report, baseline, tolerance):
+    # what got worse than the baseline by more than tolerance (0.2 is 20%): p99 latency up or throughput down
+    worse = []
+    if report["all"]["p99_ms"] > baseline["all"]["p99_ms"]*(1 + tolerance):
+        worse.append("p99 latency %.3f ms (was %.3f ms)" % (report["all"]["p99_ms"], baseline["all"]["p99_ms"]))
+    if report["messages_per_sec"] < baseline["messages_per_sec"]*(1 - tolerance):
+        worse.append("throughput %.0f messages/s (was %.0f)" % (report["messages_per_sec"], baseline["messages_per_sec"]))
+    if report["errors"] + report["connection_errors"] > baseline["errors"] + baseline["connection_errors"]:
+        worse.append("%d errors (was %d)" % (report["errors"] + report["connection_errors"], baseline["errors"] + baseline["connection_errors"]))
+    return worse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Qonnect Four server load generator")
+    parser.add_argument("--games", type = int, default = 500, help = "games played at once, two clients each")
+    parser.add_argument("--moves", type = int, default = 20, help = "moves per game at most (games can end sooner)")
+    parser.add_argument("--rate", type = float, default = 2.0, help = "moves per second in each game, 0 for as fast as possible")
+    parser.add_argument("--receive", choices = ["push", "poll"], default = "push", help = "how the other player gets each move")
+    parser.add_argument("--poll", type = float, default = 0.05, help = "seconds between GET_MOVE polls")
+    parser.add_argument("--mode", choices = ["relay", "hosted"], default = "relay", help = "relayed moves or games run by the server")
+    parser.add_argument("--columns", type = int, default = 7)
+    parser.add_argument("--depth", type = int, default = 2)
+    parser.add_argument("--seed", type = int, default = 721)
+    parser.add_argument("--ramp", type = float, default = 2.0, help = "seconds over which the games connect")
+    parser.add_argument("--interval", type = float, default = 0.5, help = "seconds between samples of the server's CPU and memory")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = None, help = "of a running server (default: start one)")
+    parser.add_argument("--server-pid", type = int, default = None, help = "of a running server, to sample its CPU and memory")
+    parser.add_argument("--out", default = None, help = "JSON file to write (default: print)")
+    parser.add_argument("--compare", default = None, help = "JSON of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "allowed change of p99 latency and throughput, 0.2 is 20%%")
+    options = parser.parse_args()
+
+    #every client is a socket, and so is its end on the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if options.mode == "hosted":
+        options.seed = playable_seed(options.columns, options.depth, options.seed)
+
+    server = None
+    if options.port is None:
+        options.port = free_port()
+        server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py"),
+                                   "--host", options.host, "--port", str(options.port), "--quiet"], stdout = subprocess.DEVNULL)
+        options.server_pid = server.pid
+    try:
+        report = asyncio.run(run(options))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if options.out is None:
+        json.dump(report, sys.stdout, indent = 1)
+        print()
+    else:
+        with open(options.out, "w") as f:
+            json.dump(report, f, indent = 1)
+    if options.compare is not None:
+        with open(options.compare) as f:
+            worse = compare(report, json.load(f), options.tolerance)
+        for w in worse:
+            print("Worse: " + w, file = sys.stderr)
+        if worse:
+            sys.exit(1)
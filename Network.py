@@ -1,22 +1,129 @@
+import queue
 import socket
+import struct
+import threading
+
+import Protocol
 
 
 class Network:
 
-    def __init__(self, IP):
+    def __init__(self, IP, room = "default", create = 0, port = 5555, watch = 0, timeout = 60):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.host = IP 
-        self.port = 5555
+        self.port = port
         self.addr = (self.host, self.port)
-        self.id = self.connect()
+        self.room = room
+        self.timeout = timeout # seconds to wait for a reply read by the receiver thread
+        self.decoder = Protocol.Decoder()
+        self.replies = []
+        self.receiver = None # background thread once subscribed
+        self.deferred = [] # moves pushed while a callback was waiting for a reply
+        self.snapshot = None # (seed, depth, columns, StartPlayer, moves so far) when watching
+        self.id = self.connect(create, watch)
 
-    def connect(self):
+    def connect(self, create = 0, watch = 0):
+        # creates (host) or joins the named room, the server replies with our player slot.
+        # A spectator (watch = 1) gets the game's snapshot instead, the moves so far are pushed after it
         self.client.connect(self.addr)
-        return self.client.recv(2048).decode()
+        if watch:
+            kind, reply = self.send(Protocol.WATCH, self.room)
+            if kind == Protocol.ERROR:
+                self.client.close()
+                raise ConnectionError(reply)
+            self.snapshot = reply
+            return -1
+        kind, reply = self.send(Protocol.CREATE if create else Protocol.JOIN, self.room)
+        if kind == Protocol.ERROR:
+            self.client.close()
+            raise ConnectionError(reply)
+        return reply
+
+    def leave(self):
+        return self.send(Protocol.LEAVE)
+
+    def stats(self):
+        # the server's counters as a dict
+        kind, value = self.send(Protocol.STATS)
+        if kind != Protocol.STATS:
+            raise ConnectionError("Could not get the server counters: " + str(value))
+        return value
+
+    def receive(self):
+        # next complete message from the server as (kind, value)
+        while not self.replies:
+            data = self.client.recv(4096)
+            if not data:
+                raise ConnectionError("Server closed the connection")
+            self.replies += self.decoder.feed(data)
+        kind, payload = self.replies.pop(0)
+        return kind, Protocol.decode_payload(kind, payload)
+
+    def reply(self):
+        # next reply, moves pushed in between are left for the receiver thread
+        kind, value = self.receive()
+        while kind == Protocol.PUSH:
+            self.deferred.append((kind, value))
+            kind, value = self.receive()
+        return kind, value
 
-    def send(self, data):
+    def subscribe(self, callback = None):
+        # asks the server to push the opponent's moves and starts a thread that receives them.
+        # Pushed moves are put on self.moves and passed to callback (from the receiver thread) if given.
+        kind, reply = self.send(Protocol.SUBSCRIBE)
+        if kind == Protocol.ERROR:
+            return kind, reply
+        self.listen(callback)
+        return kind, reply
+
+    def listen(self, callback = None):
+        # starts the receiver thread, spectators are pushed moves without subscribing
+        self.moves = queue.Queue()
+        self.reply_queue = queue.Queue()
+        self.callback = callback
+        self.receiver = threading.Thread(target = self.receive_loop, daemon = True)
+        self.receiver.start()
+
+    def receive_loop(self):
+        while True:
+            try:
+                if self.deferred:
+                    kind, value = self.deferred.pop(0)
+                else:
+                    kind, value = self.receive()
+            except socket.error as e:
+                self.reply_queue.put((Protocol.ERROR, str(e)))
+                return
+            except (Protocol.ProtocolError, struct.error) as e: # struct.error: a malformed payload
+                print("Stopped receiving, bad message from the server: " + str(e))
+                self.reply_queue.put((Protocol.ERROR, str(e)))
+                return
+            if kind == Protocol.PUSH:
+                self.moves.put(value)
+                if self.callback is not None:
+                    try:
+                        self.callback(value)
+                    except Exception as e: # keep receiving, later moves and replies still arrive
+                        print("Error handling move " + str(value) + ": " + repr(e))
+            else:
+                self.reply_queue.put((kind, value))
+
+    def send(self, kind, value = None):
+        return self.send_batch([(kind, value)])[0]
+
+    def send_batch(self, messages):
+        # writes all messages at once and waits for one reply to each.
+        # Replies are read by the receiver thread, unless there is none or this is it (inside a callback)
+        threaded = self.receiver is not None and threading.current_thread() is not self.receiver
+        if threaded and not self.receiver.is_alive():
+            raise ConnectionError("Lost the connection to the server")
         try:
-            self.client.send(str.encode(data))
-            return self.client.recv(2048).decode()
+            self.client.sendall(Protocol.encode_batch(messages))
+            if not threaded:
+                return [self.reply() for m in messages]
         except socket.error as e:
-            return str(e)
+            return [(Protocol.ERROR, str(e))]*len(messages)
+        try:
+            return [self.reply_queue.get(timeout = self.timeout) for m in messages]
+        except queue.Empty:
+            raise ConnectionError("No reply from the server in " + str(self.timeout) + " seconds")
@@ -0,0 +1,158 @@
+import json
+import struct
+
+# Wire format shared by Network.py and Server.py.
+# Every message is a frame: payload length (2 bytes), protocol version (1 byte), message kind (1 byte), payload.
+# Several frames can be written back to back, readers split them with Decoder regardless of how TCP chunks them.
+
+version = 1
+header = struct.Struct("!HBB")
+max_payload = 2**16 - 1
+
+#message kinds
+CREATE = 1 # room name, reply SLOT
+JOIN = 2 # room name, reply SLOT
+LEAVE = 3 # reply OK
+BYE = 4 # reply OK, then the server closes the connection
+SLOT = 5 # player slot in the room
+SEED = 6 # (seed, depth, columns, StartPlayer), sent by the host or as reply to SEED_WANT
+SEED_WANT = 7
+OK = 8
+GET_MOVE = 9 # player asking, reply MOVE with the opponent's last move
+MOVE = 10 # [player, move_no, move, positions...] as built by QonnectFour.make_move
+ERROR = 11 # message text
+SUBSCRIBE = 12 # reply OK, the opponent's moves are then pushed as they arrive
+PUSH = 13 # a move pushed by the server, same payload as MOVE, not a reply to anything
+STATS = 14 # asks for the server's counters, reply STATS with them as JSON text
+HOST = 15 # sent by the room's creator before SEED, the server then runs the game itself (reply OK)
+PLAY = 16 # [player, move_no, move, columns...] for the server to check and apply in a hosted room, reply MOVE as applied
+WATCH = 17 # room name, to follow its game as a spectator; reply SNAPSHOT followed by the moves so far as PUSH
+SNAPSHOT = 18 # (seed, depth, columns, StartPlayer, number of moves so far), the moves after it are pushed
+
+#moves by index, same order as Engine.gates
+moves = ["h", "z", "x", "y", "s", "t", "cx", "ccx", "measure"]
+measure_id = moves.index("measure")
+
+move_head = struct.Struct("!BIB") # player, move number, move index
+measure_body = struct.Struct("!BBQQ") # measured column, number of columns, collapsed columns mask, outcomes mask
+seed_body = struct.Struct("!qHBB")
+snapshot_body = struct.Struct("!qHBBI")
+slot_body = struct.Struct("!B")
+
+class ProtocolError(ValueError):
+    pass
+
+def encode_move(move):
+    player, move_no, name = move[0], move[1], move[2]
+    positions = move[3:]
+    data = move_head.pack(player, move_no, moves.index(name))
+    if name == "measure":
+        # positions are [measured column, outcome of each column (-1 if not collapsed)]
+        collapsed = 0
+        outcomes = 0
+        for a, o in enumerate(positions[1:]):
+            if o in [0, 1]:
+                collapsed |= 1 << a
+                outcomes |= o << a
+        return data + measure_body.pack(positions[0], len(positions) - 1, collapsed, outcomes)
+    return data + bytes([len(positions)] + list(positions))
+
+def decode_move(payload):
+    player, move_no, index = move_head.unpack_from(payload)
+    if index >= len(moves):
+        raise ProtocolError("Unknown move " + str(index))
+    move = [player, move_no, moves[index]]
+    body = payload[move_head.size:]
+    if index == measure_id:
+        col, cols, collapsed, outcomes = measure_body.unpack(body)
+        move.append(col)
+        for a in range(cols):
+            move.append((outcomes >> a) & 1 if (collapsed >> a) & 1 else -1)
+        return move
+    return move + list(body[1:(1 + body[0])])
+
+def encode_play(move):
+    # a move before it is played: a measurement only names the measured column
+    player, move_no, name = move[0], move[1], move[2]
+    return move_head.pack(player, move_no, moves.index(name)) + bytes([len(move) - 3] + list(move[3:]))
+
+def decode_play(payload):
+    player, move_no, index = move_head.unpack_from(payload)
+    if index >= len(moves):
+        raise ProtocolError("Unknown move " + str(index))
+    body = payload[move_head.size:]
+    return [player, move_no, moves[index]] + list(body[1:(1 + body[0])])
+
+def move_player(payload):
+    # cheap peek at who made the move, without decoding the rest
+    return payload[0]
+
+def encode_payload(kind, value):
+    if kind in [CREATE, JOIN, ERROR, WATCH]:
+        return str(value).encode('utf-8')
+    if kind == SNAPSHOT:
+        return snapshot_body.pack(*value)
+    if kind == SLOT:
+        return slot_body.pack(value)
+    if kind == SEED:
+        return seed_body.pack(*value)
+    if kind == GET_MOVE:
+        return slot_body.pack(value)
+    if kind == STATS:
+        return b'' if value is None else json.dumps(value).encode('utf-8')
+    if kind in [MOVE, PUSH]:
+        # already encoded moves (as stored by the server) are passed through
+        return value if isinstance(value, bytes) else encode_move(value)
+    if kind == PLAY:
+        return encode_play(value)
+    return b''
+
+def decode_payload(kind, payload):
+    if kind in [CREATE, JOIN, ERROR, WATCH]:
+        return payload.decode('utf-8')
+    if kind == SNAPSHOT:
+        return snapshot_body.unpack(payload)
+    if kind in [SLOT, GET_MOVE]:
+        return slot_body.unpack(payload)[0]
+    if kind == SEED:
+        return seed_body.unpack(payload)
+    if kind in [MOVE, PUSH]:
+        return decode_move(payload)
+    if kind == STATS:
+        return json.loads(payload.decode('utf-8')) if payload else None
+    if kind == PLAY:
+        return decode_play(payload)
+    if kind in [LEAVE, BYE, SEED_WANT, OK, SUBSCRIBE, HOST]:
+        return None
+    raise ProtocolError("Unknown message kind " + str(kind))
+
+def encode(kind, value = None):
+    payload = encode_payload(kind, value)
+    if len(payload) > max_payload:
+        raise ProtocolError("Message too long")
+    return header.pack(len(payload), version, kind) + payload
+
+def encode_batch(messages):
+    # several (kind, value) messages in one buffer, for a single write
+    return b''.join(encode(kind, value) for kind, value in messages)
+
+class Decoder:
+    # collects bytes as they arrive and returns every complete frame as (kind, payload bytes)
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        start = 0
+        while len(self.buffer) - start >= header.size:
+            length, ver, kind = header.unpack_from(self.buffer, start)
+            if ver != version:
+                raise ProtocolError("Unsupported protocol version " + str(ver))
+            end = start + header.size + length
+            if end > len(self.buffer):
+                break
+            frames.append((kind, bytes(self.buffer[(start + header.size):end])))
+            start = end
+        del self.buffer[:start]
+        return frames
@@ -10,24 +10,23 @@
 #
 
 
-get_ipython().run_line_magic('matplotlib', 'inline')
+try:
+    get_ipython().run_line_magic('matplotlib', 'inline')
+except NameError: # plain python, not a notebook
+    pass
 
+import threading
 import numpy as np
-from PIL import Image
-from matplotlib.pyplot import imshow
-from IPython.display import Image as Im
-from IPython.display import display, clear_output
 
-from qiskit import *
-from qiskit import QuantumRegister, QuantumCircuit, ClassicalRegister
-from qiskit import BasicAer
-from qiskit.visualization import plot_state_qsphere, plot_bloch_multivector
-from qiskit.quantum_info import Statevector, Operator
-from qiskit.circuit import Gate
+#qiskit, matplotlib, PIL and IPython are only imported once something is drawn or displayed
+from Engine import Engine
+from Render import Renderer
+from AI import Search
+import Checkpoint
 
 #server stuff
-import os
 from Network import *
+import Protocol
 
 #colour codes
 black = [0, 0, 0]
@@ -37,10 +36,7 @@ red = [255, 0, 0]
 coin_colours = [yellow, red]
 
 scale = 20
-zeros = np.array([0]*4)
-ones = np.array([1]*4)
-
-gates = ["h", "z", "x", "y", "s", "t", "cx", "ccx"]
+round_coins = False # draw coins as anti-aliased circles instead of filled squares
 
 class coord:
     def __init__(self, x, y):
@@ -67,74 +63,119 @@ class rect(coord):
         self.x = coords.x
         self.y = coords.y
         
-        #image data
+        #image data, reused for the lifetime of the image
         self.data = np.zeros((height, width, 3), dtype=np.uint8)
         if colour != black:
-            self.recolour(self, rect(height, width, coords, black), colour)
+            self.data[:] = colour
     
     def recolour(self, location, colour):
-        for a in range(location.width):
-            for b in range(location.height):
-                self.data[b + location.y][a + location.x] = colour
+        self.data[location.y:(location.y + location.height), location.x:(location.x + location.width)] = colour
+    
+    def blit(self, sprite, coords):
+        self.data[coords.y:(coords.y + sprite.shape[0]), coords.x:(coords.x + sprite.shape[1])] = sprite
     
     def save_image(self):
+        from PIL import Image
         img = Image.fromarray(self.data, 'RGB')
         img.save(self.name + '.png')
         return self.name + '.png'
 
-class QonnectFour:
-    def __init__(self, cols, seed, depth = 2, StartPlayer = 0, MultiPlayer = 0, host = 1, Server_IP = '0'):
-        self.columns = cols
-        self.backend = Aer.get_backend('statevector_simulator')
-        self.depth = depth
-        self.seed = seed
-        self.ready = 0
-        self.turn = StartPlayer
+def clear_output(wait = False):
+    from IPython.display import clear_output as clear
+    clear(wait)
+
+#precomputed coin images, keyed by (colour, size, circle)
+sprites = {}
+
+def coin_sprite(colour, size = scale, circle = None):
+    if circle is None:
+        circle = round_coins
+    key = (tuple(colour), size, circle)
+    if key not in sprites:
+        if circle:
+            #coverage of each pixel by the circle, from 4x4 subsamples, blended onto the black board
+            sub = 4
+            grid = (np.arange(size*sub) + 0.5)/sub - size/2
+            inside = (grid[:, None]**2 + grid[None, :]**2) <= (0.45*size)**2
+            alpha = inside.reshape(size, sub, size, sub).mean(axis=(1, 3))
+            sprite = alpha[:, :, None]*np.array(colour) + (1 - alpha[:, :, None])*np.array(black)
+            sprite = np.rint(sprite).astype(np.uint8)
+        else:
+            sprite = np.empty((size, size, 3), dtype=np.uint8)
+            sprite[:] = colour
+        sprite.flags.writeable = False
+        sprites[key] = sprite
+    return sprites[key]
+
+class QonnectFour(Engine):
+    # notebook front-end: validation messages, display and multiplayer on top of the headless Engine
+    def __init__(self, cols, seed, depth = 2, StartPlayer = 0, MultiPlayer = 0, host = 1, Server_IP = '0', views = "all", background = 0, room = "default", on_move = None, computer = None, budget = 1.0, dtype = complex, memory = None, undo = 16):
         self.MultiPlayer = MultiPlayer
         
         #for multiplayer stuff
         self.host = "localhost"
-        self.move_no = 0
         self.move_no_opp = 0
-        self.move = "0:0:h:0"
+        self.move = [0, 0, "h", 0] # last own move as [player, move number, move, positions...]
         self.StartPlayer = StartPlayer # the person's role: 0 - Start first, else start second.
         self.host_bin = host # 1 if local system is host and host is Player 0.
-        
-        #board with initial flags of -1
-        self.board = np.full((cols, cols), -1, dtype=int)
-        self.coin_array = np.array([0]*cols)
-        self.board_img = rect(cols*scale, cols*scale,  coord(0, 0), black, "board")
+        self.on_move = on_move # called with each opponent move after it has been applied
+        self.lock = threading.RLock() # opponent moves can be applied from the network thread
+        self.computer = computer # player (0/1) played by the computer, None for none
+        self.ai = None if computer is None else Search(budget) # budget is the computer's thinking time per move in seconds
+        turn = StartPlayer
         
         #start server if multiplayer
         if MultiPlayer == 1:
             if self.host_bin == 0: # if not host, then take in the Server_IP
                 self.host = Server_IP
-            self.net = Network(self.host)
+            self.net = Network(self.host, room, self.host_bin) # the host creates the room, the other player joins it
             if self.host_bin == 1: # if game host, send seed.
-                self.net.send("seed:" + str(self.seed) + ":" + str(self.depth) + ":" + str(self.columns) + ":" + str(self.StartPlayer))
+                self.net.send(Protocol.SEED, (seed, depth, cols, StartPlayer))
             else: # the player is player 1 as not host
-                received = self.net.send("seed:want")
-                received = received.split(":")
-                self.seed = int(received[0])
-                self.depth = int(received[1])
-                self.column = int(received[2])
+                kind, received = self.net.send(Protocol.SEED_WANT)
+                if kind != Protocol.SEED:
+                    raise ConnectionError("Could not get the game settings: " + str(received))
+                seed = int(received[0])
+                depth = int(received[1])
+                cols = int(received[2])
                 if int(received[3]) == 0:
                     self.StartPlayer = 1
-                    self.turn = 0
+                    turn = 0
                 else:
                     self.StartPlayer = 0
-                    self.turn = 1
+                    turn = 1
+        
+        #board, statevector and pseudo-random initial circuit
+        #boards past about 20 columns want dtype = np.complex64; memory is the statevector budget in bytes
+        Engine.__init__(self, cols, seed, depth, turn, dtype = dtype, budget = memory)
+        self.board_img = rect(cols*scale, cols*scale,  coord(0, 0), black, "board")
         
-        #initialise pseudo-random circuit and corresponding statevector
-        self.circuit = QuantumCircuit(cols, cols)
-        self.state = Statevector(execute(self.circuit, self.backend).result().get_statevector())
-        self.generate_random()
-        self.ready = 1
+        #moves that can be taken back with undo(), not in multiplayer games (the opponent has seen them).
+        #Each is a statevector, on big boards only as many as fit in the memory budget are kept
+        note = ""
+        if undo and MultiPlayer == 0:
+            room = Checkpoint.fits(self)
+            if room is not None and room < undo:
+                note = "undo = " + str(undo) + " does not fit in the memory budget on this board, keeping " + str(room) + " checkpoints"
+                undo = room
+            if undo:
+                self.keep_checkpoints(undo)
+        
+        #views to draw after each move: "all", "none" (headless) or a list out of "board", "circuit", "qsphere", "bloch"
+        #("all" leaves out qsphere and bloch past Render.large_board columns)
+        self.renderer = Renderer(self, views, background)
+        
+        #have the opponent's moves pushed and applied as soon as they are made
+        if MultiPlayer == 1:
+            self.net.subscribe(self.apply_move)
         
         #display after starting game
-        clear_output()
+        self.clear()
         print("Welcome to Qonnect four! \n Player " + str(self.turn) + " to begin. \n Initial state:")
+        if note:
+            print(note)
         self.disp_game_state()
+        self.computer_turn()
         
     
     def send_move(self): #for user
@@ -142,8 +183,10 @@ class QonnectFour:
             print("You are playing in local mode, no one there to send moves to.")
             return
         
-        data = self.move
-        reply = self.net.send(data)
+        self.tracer.begin("send", move_no = self.move_no)
+        reply = self.net.send(Protocol.MOVE, self.move)
+        self.tracer.mark("network")
+        self.tracer.end()
         return
     
     def get_move(self): #for user
@@ -151,247 +194,242 @@ class QonnectFour:
             print("You are playing in local mode, no one moves to get.")
             return
         
-        data = str(self.StartPlayer)
-        reply = self.net.send(data)
+        self.tracer.begin("get_move", move_no = self.move_no)
+        reply = self.net.send(Protocol.GET_MOVE, self.StartPlayer)
+        self.tracer.mark("network")
+        self.tracer.end()
         info = self.parse_move(reply)
         
         if info[1] == 0:
             print("No move performed yet")
             return
         
-        #check if already received
-        if info[1] == self.move_no_opp:
-            print("Already updated opponent's move")
-            return
-        
-        #check type of move
-        if info[2] == "measure":
-            self.measure(info[3:], 0)
-            print("Player " + str(info[0]) + " performed measurement on qubit " + str(info[3]))
-            self.move_no_opp = info[1]
-            return
-        else:
-            self.add_gate(info[2], info[3:], 0)
-            print("Player " + str(info[0]) + " performed " + info[2] + " gate")
+        self.apply_move(info)
+        return
+    
+    def apply_move(self, info):
+        #applies an opponent's move [player, move number, move, positions...], pushed by the server or from get_move
+        with self.lock:
+            #check if already received
+            if info[1] == self.move_no_opp:
+                print("Already updated opponent's move")
+                return
+            
+            #check type of move, a refused one (0) is reported by invalid()
+            if info[2] == "measure":
+                if self.measure(info[3:], 0) == 0:
+                    return
+                print("Player " + str(info[0]) + " performed measurement on qubit " + str(info[3]))
+            else:
+                if self.add_gate(info[2], info[3:], 0) == 0:
+                    return
+                print("Player " + str(info[0]) + " performed " + info[2] + " gate")
             self.move_no_opp = info[1]
+        
+        if self.on_move is not None:
+            self.on_move(info)
         return
     
     def parse_move(self, mess):
-        data = mess.split(":")
-        reply = [0, 0, "h"] #default placeholder
-        reply[0] = int(data[0])
-        reply[1] = int(data[1])
-        reply[2] = data[2]
-        for a in range(len(data) - 3):
-            reply.append(int(data[a + 3]))
-        return reply
+        #mess is a (kind, value) reply from Network, moves are decoded by Protocol.decode_move
+        kind, value = mess
+        if kind == Protocol.MOVE:
+            return value
+        raise ConnectionError("Expected a move from the server, got: " + str(value))
     
     def make_move(self, move, qubit_pos = []):
-        data = str(self.StartPlayer) + ":" + str(self.move_no) + ":" + move
-        for a in qubit_pos:
-            data = data + ":" + str(a)
-        self.move = data
+        #encoded with Protocol.encode_move when sent
+        self.move = [self.StartPlayer, self.move_no, move] + [int(a) for a in qubit_pos]
         return
         
+    def clear(self):
+        #with background drawing the last move's views are shown first, they would land after the clear otherwise
+        self.renderer.wait()
+        clear_output()
+        return
+    
     def disp_game_state(self):
-        print("Board:")
-        self.disp_board()
-        print("Circuit:")
-        self.disp_circuit()
-        print("Qsphere:")
-        self.disp_qsphere()
-        print("Bloch spheres:")
-        self.disp_bloch_multivector()
+        self.renderer.show()
+        return
+    
+    def set_views(self, views):
+        self.renderer.select(views)
         return
     
     def disp_circuit(self):
-        self.circuit.draw('mpl').savefig('circuit.png')
-        display(Im(filename='circuit.png', unconfined = True))
+        self.renderer.show(["circuit"])
         return
         
     def disp_board(self):
-        self.board_img.save_image()
-        display(Im(filename='board.png'))
+        self.renderer.show(["board"])
         return
     
     def disp_qsphere(self):
-        plot_state_qsphere(self.state.data).savefig('qsphere.png')
-        display(Im(filename='qsphere.png', unconfined = True))
+        self.renderer.show(["qsphere"])
         return
     
     def disp_bloch_multivector(self):
-        plot_bloch_multivector(self.state.data).savefig('bloch.png')
-        display(Im(filename='bloch.png', unconfined = True))
+        self.renderer.show(["bloch"])
+        return
+    
+    def hints(self):
+        #what measuring each open column could give, see Engine.outcomes; the game is not changed
+        analysis = self.outcomes()
+        for a in self.open_columns():
+            text = []
+            for o in range(2):
+                if analysis["p"][a, o] < 1e-12:
+                    continue
+                line = str(o) + " with probability " + str(round(float(analysis["p"][a, o]), 3))
+                others = [str(x) + ":" + str(v) for x, v in enumerate(analysis["collapsed"][a, o]) if v != -1 and x != a]
+                if others:
+                    line += ", also collapses " + " ".join(others)
+                if analysis["winner"][a, o] != -1:
+                    line += ", Player " + str(analysis["winner"][a, o]) + " wins"
+                text.append(line)
+            print("Column " + str(a) + ": " + "; ".join(text))
+        return analysis
+    
+    def undo(self):
+        #takes back the last move, against the computer also its reply so it is your turn again
+        if self.checkpoints is None:
+            print("Moves can't be taken back in this game.")
+            return
+        try:
+            Engine.undo(self)
+            while self.ai is not None and self.turn == self.computer and len(self.checkpoints):
+                Engine.undo(self)
+        except ValueError as e:
+            print(e)
+            return
+        self.redraw_board()
+        self.clear()
+        print("Move taken back, Player " + str(self.turn) + "'s turn now.")
+        self.disp_game_state()
+        self.computer_turn() # when it moved first and everything was taken back
         return
     
+    def redraw_board(self):
+        #board image from the board, after moves were taken back
+        self.board_img.data[:] = 0
+        for x in range(self.columns):
+            for y in range(self.columns):
+                if self.board[x][y] != -1:
+                    temp_coord = coord(x, y)
+                    temp_coord.rescale(scale)
+                    self.board_img.blit(coin_sprite(coin_colours[self.board[x][y]]), temp_coord)
+        self.renderer.mark()
+    
     def pass_turn(self):
         print("Player " + str(self.turn) + " has played their turn.")
-        self.turn = 1 - self.turn
+        Engine.pass_turn(self)
         print("Player " + str(self.turn) + "'s turn now.")
     
-    def check_pure(self):
-        temp = [0]*self.columns
-        for a in range(self.columns):
-            if np.isclose(self.state.probabilities([a])[0], 0.0, 1e-3) or np.isclose(self.state.probabilities([a])[0], 1.0, 1e-3):
-                temp[a] = 1
-        return temp
+    def computer_turn(self):
+        #plays the computer's move if it is its turn
+        if self.ai is None or self.turn != self.computer or self.over():
+            return
+        gate, args = self.ai.best_move(self)
+        if gate == "measure":
+            self.measure(args[0])
+        else:
+            self.add_gate(gate, args)
+        print("Computer played " + gate + " on " + str(args))
+    
+    def invalid(self, message):
+        #the move was refused, the caller ends its trace with the error
+        self.clear()
+        print(message)
+        self.disp_game_state()
+        self.tracer.mark("render")
+        return 0
+    
+    def check_order(self):
+        #no moves once the game is over; when multiplayer, check if it is our move
+        if self.over():
+            print("Invalid move. The game is over.")
+            return 0
+        if self.MultiPlayer == 1:
+            if self.StartPlayer == 0 and self.move_no != self.move_no_opp: # if player 0, then should play first
+                print("Invalid move. Wait for other player to play move or try receiving move by game.get_move().")
+                return 0
+            if self.StartPlayer == 1 and self.move_no != (self.move_no_opp - 1):
+                print("Invalid move. Wait for other player to play move or try receiving move by game.get_move().")
+                return 0
+        return 1
     
     def measure(self, qubit_pos, flag = 1):
         
-        #when multiplayer, check if valid
         if flag: # if performing own move
-            if self.MultiPlayer == 1:
-                if self.StartPlayer == 0 and self.move_no != self.move_no_opp: # if player 0, then should play first
-                    print("Invalid move. Wait for other player to play move or try receiving move by game.get_move().")
-                    return
-                if self.StartPlayer == 1 and self.move_no != (self.move_no_opp - 1):
-                    print("Invalid move. Wait for other player to play move or try receiving move by game.get_move().")
-                    return
-
-            #check if the column is not full already
-            if type(qubit_pos) != type(2):
-                clear_output()
-                print("Invalid input! Provide an integer for position number")
-                self.disp_game_state()
-                return 0
-            if self.coin_array[qubit_pos] == self.columns:
-                clear_output()
-                print("Column full, try different move")
-                self.disp_game_state()
-                return 0
-            if qubit_pos >= self.columns:
-                clear_output()
-                print("Column out of bounds! Enter value between 0 and " + str(self.column))
-                self.disp_game_state()
-                return 0
+            if not self.check_order():
+                return
+            self.tracer.begin("measure", args = [qubit_pos], player = self.turn, move_no = self.move_no, opponent = False)
+        else: # when updating opponent's move
+            self.tracer.begin("measure", args = [qubit_pos[0]], player = 1 - self.StartPlayer, opponent = True)
+        info = {} # for the end of the trace
+        try:
+            if flag:
+                try:
+                    self.check_column(qubit_pos)
+                    if self.checkpoints is not None: # only once the move is known to be valid
+                        self.checkpoints.take()
+                    positions, results = self.measure_column(qubit_pos)
+                except ValueError as e:
+                    info["error"] = str(e)
+                    return self.invalid(info["error"])
+                
+                #for making move to send (for multiplayer)
+                self.move_no += 1
+                self.make_move("measure", self.outcome_list(positions, results))
             else:
-                self.coin_array[qubit_pos] +=1
-
-            #get premeasurement pure states
-            pure_before = self.check_pure()
-
-            #perform measurement
-            result, self.state = self.state.measure([qubit_pos])
-            result = int(result)
-            self.circuit.measure([qubit_pos], [qubit_pos])
-            self.circuit.barrier()
-
-            #check if any other qubits collapsed to pure due to measurement
-            pure_after = self.check_pure()
-
-            positions = [qubit_pos]
-            results = [result]
-
-            for a in range(self.columns):
-                if pure_after[a] == 1 and pure_before[a] == 0 and a != qubit_pos:
-                    positions.append(a)
-                    res_extra, self.state = self.state.measure([a])
-                    res_extra = int(res_extra)
-                    results.append(res_extra)
-                    self.coin_array[a] += 1
-
-            #for making move to send (for multiplayer)
-            temp = [-1]*7
-            for a in range(len(positions)):
-                temp[positions[a]] = results[a]
-            self.move_no += 1
-            temp = [positions[0]] + temp # so we can mark where measurement was performed
-            #temp = np.concatenate([temp, self.state.data])
-            self.make_move("measure", temp)
-        
-        if not flag: # when updating opponent's move
-            self.circuit.measure([qubit_pos[0]], [qubit_pos[0]])
-            self.circuit.barrier()
+                try:
+                    positions, results = self.replay_measure(qubit_pos)
+                except ValueError as e: # a malformed move, raising would stop the network thread
+                    info["error"] = "Invalid move from the opponent: " + str(e)
+                    return self.invalid(info["error"])
+            info["positions"], info["results"] = positions, [int(r) for r in results]
             
-            temp2 = qubit_pos[1:(self.columns+1)]
+            #update board and display
+            self.renderer.mark()
+            for a in range(len(positions)):
+                temp_coord = coord(positions[a], self.columns - self.coin_array[positions[a]])
+                temp_coord.rescale(scale)
+                #add coin
+                self.board_img.blit(coin_sprite(coin_colours[results[a]]), temp_coord)
+            self.tracer.mark("board")
             
-            meas = -2
-            while meas != qubit_pos[qubit_pos[0] + 1]:
-                res, state = self.state.measure([qubit_pos[0]])
-                meas = int(res)
-            self.state = state
+            #check for matches through the new coins
+            end, player = self.check_coins(positions)
+            self.tracer.mark("win_check")
+            if end:
+                self.winner = player
+                info["winner"] = player
+                self.clear()
+                print("Player "+ str(player) + " wins! \n ")
+                print("Final state: ")
+                self.disp_game_state()
+                self.tracer.mark("render")
+                if self.MultiPlayer:
+                    self.send_move()
+                wrap_up(self)
+                self.tracer.mark("network")
+                return
             
-            positions = []
-            results = []
-            for a in range(self.columns):
-                if temp2[a] == 0:
-                    results.append(0)
-                    positions.append(a)
-                    self.coin_array[a] += 1
-                elif temp2[a] == 1:
-                    results.append(1)
-                    positions.append(a)
-                    self.coin_array[a] += 1
-        
-        #update board and display
-        for a in range(len(positions)):
-            temp_coord = coord(positions[a], self.columns - self.coin_array[positions[a]])
-            self.board[temp_coord.x][temp_coord.y] = results[a]
-            temp_coord.rescale(scale)
-            #add coin
-            self.board_img.recolour(rect(scale, scale, temp_coord), coin_colours[results[a]])
-        
-        #check for matches
-        end, player = self.check_board()
-        if end:
-            clear_output()
-            print("Player "+ str(player) + " wins! \n ")
-            print("Final state: ")
+            self.clear()
+            print("Current state:")
             self.disp_game_state()
-            if self.MultiPlayer:
-                self.send_move()
-            wrap_up(self)
-            return
-        
-        clear_output()
-        print("Current state:")
-        self.disp_game_state()
+            self.tracer.mark("render")
+        finally:
+            self.tracer.end(**info)
         
         if flag:
             self.pass_turn()
-        return
-    
-    def generate_random(self):
-        seed_digits = [int(d) for d in str(bin((self.seed + 500)**3))[2:]]
-        seed_digits = seed_digits[:(len(seed_digits) - (len(seed_digits)%3))]
-        
-        gate_sequence = []
-        for a in range(int(len(seed_digits)/3)):
-            gate_sequence.append(4*seed_digits[3*a] + 2*seed_digits[3*a + 1] + seed_digits[3*a + 2])
-        
-        number_temp = self.depth*self.columns*3
-        gate_sequence_temp = gate_sequence
-        
-        if len(gate_sequence_temp) < number_temp:
-            for a in range(int(number_temp/len(gate_sequence_temp))):
-                gate_sequence += [int((d + self.seed*a)%8) for d in gate_sequence_temp]
-        
-        for d in range(self.depth):
-            for a in range(self.columns):
-                if gate_sequence[0] <= 5:
-                    self.add_gate(gates[gate_sequence[0]], [a])
-                    gate_sequence = gate_sequence[1:]
-                    continue
-                    
-                if gate_sequence[0] == 6:
-                    b = gate_sequence[1]%self.columns - int(a == gate_sequence[1]%self.columns)
-                    self.add_gate('cx', [a, b])
-                    gate_sequence = gate_sequence[2:]
-                    continue
-                    
-                if gate_sequence[0] == 7:
-                    b = gate_sequence[1]%self.columns - int(a == gate_sequence[1]%self.columns)
-                    c = gate_sequence[2]%self.columns
-                    c = c - int(c==a) - int(((c - int(c==a)) == b))
-                    self.add_gate('ccx', [a, b, c])
-                    gate_sequence = gate_sequence[3:]
-                    continue
-        self.circuit.barrier()
+            self.computer_turn()
         return
     
     def h(self, args):
         if type(args) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -400,7 +438,7 @@ class QonnectFour:
     
     def z(self, args):
         if type(args) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -409,7 +447,7 @@ class QonnectFour:
     
     def x(self, args):
         if type(args) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -418,7 +456,7 @@ class QonnectFour:
     
     def y(self, args):
         if type(args) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -427,7 +465,7 @@ class QonnectFour:
     
     def s(self, args):
         if type(args) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -436,7 +474,7 @@ class QonnectFour:
     
     def t(self, args):
         if type(args) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -445,7 +483,7 @@ class QonnectFour:
     
     def cx(self, arg1, arg2):
         if type(arg1) != type(2) or type(arg2) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -454,7 +492,7 @@ class QonnectFour:
     
     def ccx(self, arg1, arg2, arg3):
         if type(arg1) != type(2) or type(arg2) != type(2) or type(arg2) != type(2):
-            clear_output()
+            self.clear()
             print("Invalid positional argument. Please pass a single position as argument.")
             self.disp_game_state()
             return 0
@@ -463,119 +501,39 @@ class QonnectFour:
     
     def add_gate(self, gate, args, flag = 1):
         
-        if flag and self.ready:
-            if self.MultiPlayer == 1:
-                if self.StartPlayer == 0 and self.move_no != self.move_no_opp: # if player 0, then should play first
-                    print("Invalid move. Wait for other player to play move or try receiving move by game.get_move().")
-                    return
-                if self.StartPlayer == 1 and self.move_no != (self.move_no_opp - 1):
-                    print("Invalid move. Wait for other player to play move or try receiving move by game.get_move().")
-                    return
-        
-        #check if column full
-        for a in range(len(args)):
-            if self.coin_array[args[a]] == self.columns:
-                clear_output()
-                print("Column full, try different move")
-                self.disp_game_state()
-                return 0
-        
-        #apply corresponding gates/operators
-        qc_temp = QuantumCircuit(self.columns)
-        
-        if gate == "h" and len(args) == 1:
-            self.circuit.h(args)
-            qc_temp.h(args)
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "z" and len(args) == 1:
-            self.circuit.z(args)
-            qc_temp.z(args)
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "x" and len(args) == 1:
-            self.circuit.x(args)
-            qc_temp.x(args)
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "y" and len(args) == 1:
-            self.circuit.y(args)
-            qc_temp.y(args)
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "s" and len(args) == 1:
-            self.circuit.s(args)
-            qc_temp.s(args)
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "t" and len(args) == 1:
-            self.circuit.t(args)
-            qc_temp.t(args)
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "cx" and len(args) == 2:
-            self.circuit.cx(args[0], args[1])
-            qc_temp.cx(args[0], args[1])
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if gate == "ccx" and len(args) == 3:
-            self.circuit.ccx(args[0], args[1], args[2])
-            qc_temp.ccx(args[0], args[1], args[2])
-            self.state = self.state.evolve(Operator(qc_temp))
-        
-        if self.ready:
-            clear_output()
+        if flag and not self.check_order():
+            return
+        self.tracer.begin(gate, args = list(args), player = self.turn if flag else 1 - self.StartPlayer, move_no = self.move_no, opponent = not flag)
+        info = {}
+        try:
+            #apply corresponding gates to the statevector
+            try:
+                if flag and self.checkpoints is not None:
+                    self.check_gate(gate, args)
+                    self.checkpoints.take() # only once the move is known to be valid
+                self.apply_gate(gate, args)
+            except ValueError as e:
+                info["error"] = str(e) if flag else "Invalid move from the opponent: " + str(e)
+                return self.invalid(info["error"])
+            self.renderer.mark(["circuit", "qsphere", "bloch"])
+            
+            self.clear()
             print("Current state:")
             self.disp_game_state()
-            
-            if flag:
-                self.pass_turn()
-                self.move_no += 1
-                self.make_move(gate, args)
+            self.tracer.mark("render")
+        finally:
+            self.tracer.end(**info)
+        
+        if flag:
+            self.pass_turn()
+            self.move_no += 1
+            self.make_move(gate, args)
+            self.computer_turn()
         return
-    
-    def check_board(self):
-        temp = np.array([0]*4)
-        for x in range(self.columns):
-            for y in range(self.columns):
-                if self.board[x][y] !=-1:
-                    
-                    if x<= (self.columns - 4):
-                        for a in range(4):
-                            temp[a] = self.board[x + a][y]
-                                
-                        if (temp == zeros).all() or (temp == ones).all():
-                            return True, self.board[x][y]
-                        
-                        #diagonal
-                        if y<= (self.columns - 4):
-                            #temp = np.array([0]*4)
-                            for a in range(4):
-                                temp[a] = self.board[x + a][y + a]
-                            
-                            if (temp == zeros).all() or (temp == ones).all():
-                                return True, self.board[x][y]
-                    
-                    if y<= (self.columns - 4):
-                        #temp = np.array([0]*4)
-                        for a in range(4):
-                            temp[a] = self.board[x][y + a]
-                            
-                        if (temp == zeros).all() or (temp == ones).all():
-                            return True, self.board[x][y]
-                        
-                        #antidiagonal
-                        if x >= 4:
-                            for a in range(4):
-                                temp = self.board[x - a][y + a]
-                            
-                            if (temp == zeros).all() or (temp == ones).all():
-                                return True, self.board[x][y]
-        return False, -1
     #def __delete__(self)
             
 def wrap_up(Game):
     print("Hope you enjoyed! \n This is a project in progress, leave your feedback, suggestions and comment (if any) at praveen91299@gmail.com")
     if Game.MultiPlayer == 1:
-        Game.net.send('2')
+        Game.net.send(Protocol.BYE)
     del Game
@@ -0,0 +1,188 @@
+import struct
+
+import numpy as np
+
+from Engine import Engine, gate_sizes
+import Protocol
+
+# Game records: seed, depth, columns and every move in a compact binary form, plus statevector snapshots
+# every few moves so replay can start from the nearest one instead of from generate_random.
+#
+# File layout (little endian):
+#   header   magic, version, seed, depth, columns, start player, number of moves, number of snapshots, move bytes
+#   moves    one byte of move index (low 4 bits) and player (bit 4), then the gate's columns, or for a measurement
+#            the measured column and the collapsed and outcome masks of all columns in (columns + 7)//8 bytes each
+#   index    the move number of each snapshot, 4 bytes each
+#   padding  up to a multiple of 16 bytes
+#   states   the snapshots as raw complex128 arrays of 2^columns amplitudes, loaded with np.memmap
+#
+# Moves are kept in the shape QonnectFour.make_move builds, [player, move number, move, positions...], where the
+# positions of a measurement are [measured column, outcome of each column (-1 if not collapsed)].
+
+magic = b"QFR\0"
+version = 1
+header = struct.Struct("<4sBqHBBIIQ")
+
+def mask_size(cols):
+    return (cols + 7)//8
+
+def encode_move(move, cols):
+    player, name, positions = move[0], move[2], move[3:]
+    data = bytes([Protocol.moves.index(name) | (player << 4)])
+    if name != "measure":
+        return data + bytes(positions)
+    collapsed = 0
+    outcomes = 0
+    for a, o in enumerate(positions[1:]):
+        if o in [0, 1]:
+            collapsed |= 1 << a
+            outcomes |= o << a
+    size = mask_size(cols)
+    return data + bytes([positions[0]]) + collapsed.to_bytes(size, "little") + outcomes.to_bytes(size, "little")
+
+def decode_moves(data, cols):
+    moves = []
+    size = mask_size(cols)
+    a = 0
+    while a < len(data):
+        index, player = data[a] & 15, data[a] >> 4
+        name = Protocol.moves[index]
+        if name != "measure":
+            k = gate_sizes.get(name, 1)
+            moves.append([player, len(moves), name] + list(data[(a + 1):(a + 1 + k)]))
+            a += 1 + k
+            continue
+        collapsed = int.from_bytes(data[(a + 2):(a + 2 + size)], "little")
+        outcomes = int.from_bytes(data[(a + 2 + size):(a + 2 + 2*size)], "little")
+        moves.append([player, len(moves), name, data[a + 1]] + [(outcomes >> b) & 1 if (collapsed >> b) & 1 else -1 for b in range(cols)])
+        a += 2 + 2*size
+    return moves
+
+def outcome_list(cols, positions, results):
+    # [measured column, outcome of each column (-1 if not collapsed)]
+    outcomes = [-1]*cols
+    for x, r in zip(positions, results):
+        outcomes[x] = int(r)
+    return [positions[0]] + outcomes
+
+class GameRecord:
+    def __init__(self, cols, seed, depth = 2, start = 0, interval = 16):
+        self.columns = cols
+        self.seed = seed
+        self.depth = depth
+        self.start = start
+        self.interval = interval # moves between snapshots
+        self.moves = []
+        self.snapshots = [] # move numbers
+        self.states = [] # statevector after that many moves
+
+    def snapshot(self, state):
+        self.snapshots.append(len(self.moves))
+        self.states.append(np.array(state.data, dtype="<c16"))
+
+    def add(self, move, state):
+        # move as make_move builds it, state is the statevector after it
+        self.moves.append(list(move))
+        if len(self.moves) % self.interval == 0:
+            self.snapshot(state)
+
+    def to_bytes(self):
+        moves = b"".join(encode_move(m, self.columns) for m in self.moves)
+        head = header.pack(magic, version, self.seed, self.depth, self.columns, self.start, len(self.moves), len(self.snapshots), len(moves))
+        index = struct.pack("<" + str(len(self.snapshots)) + "I", *self.snapshots)
+        data = head + moves + index
+        data += bytes(-len(data) % 16)
+        return data + b"".join(s.tobytes() for s in self.states)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+def load(path):
+    # reads the moves and memory maps the snapshots, which are only read from disk when a replay needs one
+    with open(path, "rb") as f:
+        head = f.read(header.size)
+        tag, ver, seed, depth, cols, start, count, snaps, size = header.unpack(head)
+        if tag != magic or ver != version:
+            raise ValueError(path + " is not a version " + str(version) + " game record")
+        moves = f.read(size)
+        index = list(struct.unpack("<" + str(snaps) + "I", f.read(4*snaps)))
+    record = GameRecord(cols, seed, depth, start)
+    record.moves = decode_moves(moves, cols)
+    record.snapshots = index
+    offset = header.size + size + 4*snaps
+    offset += -offset % 16
+    if snaps:
+        record.states = np.memmap(path, dtype="<c16", mode="r", offset=offset, shape=(snaps, 2**cols))
+    if len(record.moves) != count:
+        raise ValueError(path + " is truncated")
+    return record
+
+class Recorder:
+    # plays moves on an Engine and records them
+    def __init__(self, game, interval = 16):
+        self.game = game
+        self.record = GameRecord(game.columns, game.seed, game.depth, game.turn, interval)
+        self.record.snapshot(game.state) # the initial state, so replay never needs generate_random
+        self.start_move = game.move_no
+
+    def play(self, move):
+        player, move_no = self.game.turn, self.game.move_no - self.start_move
+        positions, results = self.game.play(move)
+        if move[0] == "measure":
+            self.record.add([player, move_no, "measure"] + outcome_list(self.game.columns, positions, results), self.game.state)
+        else:
+            self.record.add([player, move_no, move[0]] + [int(a) for a in move[1]], self.game.state)
+        return positions, results
+
+class Replay:
+    # an Engine that can be moved to any move of a record, forwards from where it is or from the nearest snapshot
+    def __init__(self, record):
+        self.record = record
+        self.game = None
+        self.position = -1
+
+    def start(self, s):
+        # engine at snapshot s, with the coins of all moves before it placed without touching the statevector
+        record = self.record
+        move_no = record.snapshots[s]
+        game = Engine(record.columns, record.seed, record.depth, record.start, record.states[s])
+        for m in record.moves[:move_no]:
+            if m[2] == "measure":
+                positions = [m[3]] + [a for a in range(record.columns) if m[4 + a] in [0, 1] and a != m[3]]
+                game.place(positions, [m[4 + a] for a in positions])
+        if move_no:
+            self.finish(game, record.moves[move_no - 1])
+        game.move_no = move_no
+        game.turn = record.start if move_no % 2 == 0 else 1 - record.start
+        self.game = game
+        self.position = move_no
+
+    def finish(self, game, m):
+        # winner after move m, only the last move can have ended the game
+        if m[2] == "measure":
+            end, player = game.check_coins([m[3]] + [a for a in range(game.columns) if m[4 + a] in [0, 1] and a != m[3]])
+            if end:
+                game.winner = player
+
+    def step(self):
+        m = self.record.moves[self.position]
+        if m[2] == "measure":
+            self.game.replay_measure(m[3:])
+            self.finish(self.game, m)
+        else:
+            self.game.apply_gate(m[2], m[3:])
+        self.game.move_no += 1
+        self.game.pass_turn()
+        self.position += 1
+
+    def seek(self, move_no):
+        # game as it was after move_no moves
+        if not 0 <= move_no <= len(self.record.moves):
+            raise ValueError("Move " + str(move_no) + " out of range, the game has " + str(len(self.record.moves)) + " moves")
+        s = max(a for a in range(len(self.record.snapshots)) if self.record.snapshots[a] <= move_no)
+        if not self.record.snapshots[s] <= self.position <= move_no:
+            self.start(s)
+        while self.position < move_no:
+            self.step()
+        return self.game
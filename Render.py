@@ -0,0 +1,123 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+#matplotlib, qiskit and IPython are imported on first draw, so a headless game never loads them
+
+#all views in display order with their headings
+views = ["board", "circuit", "qsphere", "bloch"]
+titles = {"board": "Board:", "circuit": "Circuit:", "qsphere": "Qsphere:", "bloch": "Bloch spheres:"}
+
+#which views depend on what
+state_views = ["circuit", "qsphere", "bloch"]
+board_views = ["board"]
+
+#"all" leaves out the views plotting every amplitude on boards wider than this, they take minutes to draw
+large_board = 16
+amplitude_views = ["qsphere", "bloch"]
+
+def select_views(selection, cols = 0):
+    # "all", "none" or a list of view names
+    if selection == "all" or selection is None:
+        return [v for v in views if cols <= large_board or v not in amplitude_views]
+    if selection == "none":
+        return []
+    for v in selection:
+        if v not in views:
+            raise ValueError("Unknown view " + str(v) + ", choose from " + str(views))
+    return [v for v in views if v in selection]
+
+def figure_png(fig):
+    import matplotlib.pyplot as plt
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    plt.close(fig)
+    return buf.getvalue()
+
+def image_png(data):
+    # PNG bytes of an RGB array
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(data, 'RGB').save(buf, format='PNG')
+    return buf.getvalue()
+
+class Renderer:
+    # Keeps one PNG (bytes, in memory) per view and only redraws views marked dirty since the last draw.
+    # With background = 1 drawing and display happen on a worker thread so moves return straight away.
+    def __init__(self, game, selection = "all", background = 0):
+        self.game = game
+        self.views = select_views(selection, game.columns)
+        self.dirty = dict((v, True) for v in views)
+        self.images = {}
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(1) if background else None
+        self.job = None
+
+    def select(self, selection):
+        self.views = select_views(selection, self.game.columns)
+
+    def mark(self, changed = views):
+        for v in changed:
+            self.dirty[v] = True
+
+    def snapshot(self, selected):
+        #copies of the inputs for the dirty views, taken on the caller's thread so the game can move on;
+        #the board is its pixels, encoded in draw
+        inputs = {}
+        for v in selected:
+            if not self.dirty[v]:
+                continue
+            if v == "board":
+                inputs[v] = self.game.board_img.data.copy()
+            elif v == "circuit":
+                inputs[v] = self.game.circuit.copy()
+            else:
+                inputs[v] = self.game.state.data.copy()
+            self.dirty[v] = False
+        return inputs
+
+    def draw(self, inputs):
+        for v in inputs:
+            if v == "board":
+                png = image_png(inputs[v])
+            elif v == "circuit":
+                png = figure_png(inputs[v].draw('mpl'))
+            elif v == "qsphere":
+                from qiskit.visualization import plot_state_qsphere
+                png = figure_png(plot_state_qsphere(inputs[v]))
+            else:
+                from qiskit.visualization import plot_bloch_multivector
+                png = figure_png(plot_bloch_multivector(inputs[v]))
+            with self.lock:
+                self.images[v] = png
+
+    def display(self, selected):
+        from IPython.display import Image as Im
+        from IPython.display import display
+        for v in selected:
+            with self.lock:
+                png = self.images.get(v)
+            if png is not None:
+                print(titles[v])
+                display(Im(data=png, unconfined=True))
+
+    def run(self, inputs, selected):
+        self.draw(inputs)
+        self.display(selected)
+
+    def show(self, selection = None):
+        selected = self.views if selection is None else select_views(selection, self.game.columns)
+        if not selected:
+            return
+        inputs = self.snapshot(selected)
+        if self.executor is None:
+            self.run(inputs, selected)
+        else:
+            self.job = self.executor.submit(self.run, inputs, selected)
+        return
+
+    def wait(self):
+        #block until the background worker has finished drawing
+        if self.job is not None:
+            self.job.result()
+            self.job = None
@@ -0,0 +1,216 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from Engine import Engine, gates
+from AI import Search
+import Record
+import Initial
+
+# Plays many games between policies on a process pool and streams one record per game.
+# A policy is called with (engine, rng) and returns a move (gate or "measure", qubits) for engine.turn.
+# Policies are classes so they can be pickled to the workers.
+
+class RandomPolicy:
+    def __init__(self, p_measure = 0.3):
+        self.p_measure = p_measure
+
+    def __call__(self, game, rng):
+        cols = game.open_columns()
+        if rng.random() < self.p_measure or len(cols) < 3:
+            return ("measure", [int(rng.choice(cols))])
+        gate = gates[rng.integers(len(gates))]
+        size = {"cx": 2, "ccx": 3}.get(gate, 1)
+        return (gate, [int(a) for a in rng.choice(cols, size, replace=False)])
+
+class GreedyPolicy:
+    # measures the column most likely to give its own colour, preferring columns where that coin would win
+    def __call__(self, game, rng):
+        p_own = game.state.marginals()[:, game.turn]
+        best = None
+        for a in game.open_columns():
+            score = p_own[a] + game.bitboard.would_win(a, game.coin_array[a], game.turn)
+            if best is None or score > best[0]:
+                best = (score, a)
+        return ("measure", [best[1]])
+
+class ScriptedPolicy:
+    # plays the given moves in order (skipping ones on full columns), then falls back to another policy.
+    # Keeps its place in the script, so use a new one for each game. Raises ValueError for columns off the board.
+    def __init__(self, moves, fallback = None):
+        self.moves = moves
+        self.fallback = RandomPolicy() if fallback is None else fallback
+        self.index = 0
+
+    def __call__(self, game, rng):
+        while self.index < len(self.moves):
+            move = self.moves[self.index]
+            self.index += 1
+            if any(q < 0 or q >= game.columns for q in move[1]):
+                raise ValueError("Scripted move " + str(move) + " is off a board with " + str(game.columns) + " columns")
+            if all(game.coin_array[q] < game.columns for q in move[1]):
+                return move
+        return self.fallback(game, rng)
+
+def parse_policy(spec):
+    # "random", "random:0.5", "greedy", "search", "search:0.2" (seconds per move) or "scripted:h0,cx1.2,measure3"
+    name, _, arg = spec.partition(":")
+    if name == "random":
+        return RandomPolicy(float(arg)) if arg else RandomPolicy()
+    if name == "greedy":
+        return GreedyPolicy()
+    if name == "search":
+        return Search(float(arg)) if arg else Search()
+    if name == "scripted":
+        moves = []
+        for m in arg.split(","):
+            gate = m.rstrip("0123456789.")
+            moves.append((gate, [int(q) for q in m[len(gate):].split(".")]))
+        return ScriptedPolicy(moves)
+    raise ValueError("Unknown policy " + spec)
+
+def play_game(cols, seed, depth, game, policies, max_moves = None, records = None):
+    # one full game, reproducible from (seed, game): the same seed gives the same start and measurement outcomes.
+    # With records set to a directory, the game record is saved there (see Record.py).
+    rng = np.random.default_rng([seed, game])
+    start = game % 2
+    record = {"seed": seed, "depth": depth, "columns": cols, "game": game, "start": start,
+              "policies": [p for p in policies], "winner": -1, "moves": 0, "measurements": 0, "error": ""}
+    try:
+        engine = Engine(cols, seed, depth, start)
+    except ValueError as e: # the seed's initial circuit is not playable on this board
+        record["error"] = str(e)
+        return record
+    engine.state.rng = rng
+    recorder = None if records is None else Record.Recorder(engine)
+    if max_moves is None:
+        max_moves = 10*cols*cols
+    t = time.perf_counter()
+    try:
+        players = [parse_policy(p) for p in policies]
+        while not engine.over() and engine.move_no < max_moves:
+            move = players[engine.turn](engine, rng)
+            if recorder is None:
+                engine.play(move)
+            else:
+                recorder.play(move)
+            record["measurements"] += move[0] == "measure"
+    except ValueError as e: # a policy made a move the engine refuses, the rest of the run goes on
+        record["error"] = "Move " + str(engine.move_no) + ": " + str(e)
+        record["moves"] = engine.move_no
+        return record
+    record["time"] = time.perf_counter() - t
+    if recorder is not None:
+        recorder.record.save(os.path.join(records, "%d_%d_%d_%d.qfr" % (seed, depth, cols, game)))
+    record["winner"] = engine.winner
+    record["moves"] = engine.move_no
+    return record
+
+def play_chunk(jobs, policies, max_moves, records = None, cache = None):
+    if cache is not None: # initial statevectors shared between the workers through this directory
+        Initial.cache.persist(cache)
+    return [play_game(cols, seed, depth, game, policies, max_moves, records) for cols, seed, depth, game in jobs]
+
+def shard(jobs, chunk):
+    return [jobs[a:(a + chunk)] for a in range(0, len(jobs), chunk)]
+
+class Stats:
+    # running aggregates over finished games
+    def __init__(self):
+        self.groups = {}
+        self.total = {"games": 0, "moves": 0, "wins": [0, 0], "draws": 0, "first_wins": 0, "errors": 0}
+
+    def add(self, record):
+        key = (record["seed"], record["depth"], record["columns"])
+        for s in [self.total, self.groups.setdefault(key, {"games": 0, "moves": 0, "wins": [0, 0], "draws": 0, "first_wins": 0, "errors": 0})]:
+            if record["error"]:
+                s["errors"] += 1
+                continue
+            s["games"] += 1
+            s["moves"] += record["moves"]
+            if record["winner"] == -1:
+                s["draws"] += 1
+            else:
+                s["wins"][record["winner"]] += 1
+                s["first_wins"] += record["winner"] == record["start"]
+
+    def summary(self, s):
+        games = max(s["games"], 1)
+        decided = max(s["games"] - s["draws"], 1)
+        return {"games": s["games"], "errors": s["errors"],
+                "win_rate": [s["wins"][0]/games, s["wins"][1]/games], "draw_rate": s["draws"]/games,
+                "mean_length": s["moves"]/games,
+                # share of decided games won by whoever moved first, 0.5 means no advantage
+                "first_player_win_share": s["first_wins"]/decided}
+
+    def report(self):
+        return {"total": self.summary(self.total),
+                "by_seed_depth_columns": [dict(seed = k[0], depth = k[1], columns = k[2], **self.summary(v)) for k, v in sorted(self.groups.items())]}
+
+fields = ["seed", "depth", "columns", "game", "start", "winner", "moves", "measurements", "time", "error"]
+
+def run(seeds, depths, columns, games, policies, workers = None, out = None, fmt = "jsonl", chunk = 16, max_moves = None, records = None, cache = None):
+    jobs = [(c, s, d, g) for c in columns for d in depths for s in seeds for g in range(games)]
+    stats = Stats()
+    writer = None
+    if out is not None:
+        f = open(out, "w", newline = "")
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames = fields, extrasaction = "ignore")
+            writer.writeheader()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(play_chunk, c, policies, max_moves, records, cache) for c in shard(jobs, chunk)]
+        for future in as_completed(futures):
+            for record in future.result():
+                stats.add(record)
+                if out is None:
+                    continue
+                if fmt == "csv":
+                    writer.writerow(record)
+                else:
+                    f.write(json.dumps(record) + "\n")
+            if out is not None:
+                f.flush()
+    if out is not None:
+        f.close()
+    return stats.report()
+
+def seed_range(text):
+    # "5", "0-99" or "1,4,9"
+    seeds = []
+    for part in text.split(","):
+        if "-" in part:
+            a, b = part.split("-")
+            seeds += list(range(int(a), int(b) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Qonnect Four self-play")
+    parser.add_argument("--games", type = int, default = 10, help = "games per (seed, depth, columns)")
+    parser.add_argument("--seeds", type = seed_range, default = [721], help = "e.g. 721, 0-99 or 1,4,9")
+    parser.add_argument("--depth", type = int, nargs = "+", default = [2])
+    parser.add_argument("--columns", type = int, nargs = "+", default = [7])
+    parser.add_argument("--policies", nargs = 2, default = ["random", "greedy"], help = "policy of player 0 and player 1")
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--chunk", type = int, default = 16, help = "games per task sent to a worker")
+    parser.add_argument("--max-moves", type = int, default = None)
+    parser.add_argument("--out", default = None, help = "file to stream one record per game to")
+    parser.add_argument("--format", choices = ["jsonl", "csv"], default = "jsonl")
+    parser.add_argument("--records", default = None, help = "directory to save a game record of every game to")
+    parser.add_argument("--cache", default = None, help = "directory to keep the initial statevector of each seed in")
+    args = parser.parse_args()
+    for p in args.policies:
+        parse_policy(p)
+    if args.records is not None:
+        os.makedirs(args.records, exist_ok = True)
+    report = run(args.seeds, args.depth, args.columns, args.games, args.policies, args.workers, args.out, args.format, args.chunk, args.max_moves, args.records, args.cache)
+    json.dump(report, sys.stdout, indent = 1)
+    print()
@@ -1,76 +1,417 @@
+import argparse
+import asyncio
+import collections
+import json
 import socket
-from _thread import *
-import sys
+import struct
+import time
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+import Protocol
 
-server = '' #replace with Server device IPv4
-port = 5555
+#spectators are sent moves without waiting on their sockets. Once this many bytes are queued for one, further moves
+#are held back and sent together when its socket drains; if it has not drained after viewer_timeout seconds it is dropped
+viewer_buffer = 2**16
+viewer_timeout = 10.0
 
-server_ip = socket.gethostbyname(server)
-print("Server IP: " + server_ip)
+class Viewer:
+    # a spectator's connection and how much of the room's move log it has been sent
+    def __init__(self, conn):
+        self.conn = conn
+        self.sent = 0
+        self.waiting = None # task waiting for the socket to drain, while the viewer is behind
 
-try:
-    s.bind((server, port))
+class Room:
+    # state of a single game, players hold one of the two slots.
+    # Moves are relayed as the clients made them, unless the creator asks for HOST: the room then runs the game
+    # on its own Engine, checks and applies each PLAY once and sends everyone the coins it placed.
+    def __init__(self, name, verbose = 1, memory = 2**26):
+        self.name = name
+        self.verbose = verbose
+        self.hosted = False
+        self.game = None # Engine of a hosted room, once the seed is known
+        self.memory = memory # statevector bytes a hosted game may use
+        self.busy = asyncio.Lock() # held while the hosted game works on a thread, see work()
+        self.players = [None, None]
+        self.subscribed = set() # connections that get moves pushed
+        self.Data = [Protocol.encode_move([0, 0, "h", 0]), Protocol.encode_move([1, 0, "h", 0])] #last move of each player, kept encoded
+        self.seed = 42
+        self.depth = 1
+        self.column = 7
+        self.StartPlayer = 0
+        self.started = False # SEED received
+        self.frames = [] # every move of the game in order, encoded once as a PUSH frame for all spectators
+        self.last = [0, 0] # last move number of each player in the log, relayed moves can be sent twice
+        self.viewers = {} # connection -> Viewer
+        self.dropped = 0
+        self.messages = 0
+        self.latency = collections.deque(maxlen = 1024) # seconds from reading the last messages to having written the replies
 
-except socket.error as e:
-    print(str(e))
+    def log(self, message):
+        if self.verbose:
+            print(self.name + ": " + message)
 
-s.listen(2)
-print("Waiting for a connection")
+    def add(self, conn):
+        for a in range(2):
+            if self.players[a] is None:
+                self.players[a] = conn
+                return a
+        return -1
 
-currentId = "0"
-Data = ["0:0:h:0", "1:0:h:0"] #player:moveID:move:positions...
-seed = 42
-depth = 1
-column = 7
-StartPlayer = 0
-def threaded_client(conn):
-    global currentId, Data, seed, depth, column, StartPlayer
-    conn.send(str.encode(currentId))
-    currentId = "1"
-    reply = ''
-    while True:
+    def remove(self, conn):
+        for a in range(2):
+            if self.players[a] is conn:
+                self.players[a] = None
+        self.subscribed.discard(conn)
+        self.viewers.pop(conn, None)
+
+    def close(self):
+        # the players have left, nothing more to watch
+        for viewer in list(self.viewers.values()):
+            viewer.conn.close()
+        self.viewers.clear()
+
+    def empty(self):
+        return self.players == [None, None]
+
+    def player(self, conn):
+        # the creator is player StartPlayer (as in QonnectFour), whoever joined the other one
+        if self.players[0] is conn:
+            return self.StartPlayer
+        if self.players[1] is conn:
+            return 1 - self.StartPlayer
+        return -1
+
+    def start(self):
+        from Engine import Engine # numpy is only needed for hosted rooms
+        try:
+            self.game = Engine(self.column, self.seed, self.depth, self.StartPlayer, budget = self.memory)
+        except MemoryError as e:
+            raise ValueError(str(e))
+        self.Data = [Protocol.encode_move([0, 0, "h", 0]), Protocol.encode_move([1, 0, "h", 0])]
+        self.log("Started a hosted game: " + str((self.seed, self.depth, self.column, self.StartPlayer)))
+
+    def play(self, payload, conn):
+        # checks a move against the room's game, applies it and returns the move as applied, encoded
+        if self.game is None:
+            raise ValueError("Room " + self.name + " has no game yet, the host sends SEED first")
+        move = Protocol.decode_play(payload)
+        player, move_no, name, args = move[0], move[1], move[2], move[3:]
+        if player != self.player(conn):
+            raise ValueError("You are player " + str(self.player(conn)) + ", not " + str(player))
+        if self.game.over():
+            raise ValueError("The game is over")
+        if player != self.game.turn:
+            raise ValueError("Not your turn, player " + str(self.game.turn) + " to play")
+        if move_no != self.game.move_no:
+            raise ValueError("Move " + str(move_no) + " is out of date, " + str(self.game.move_no) + " moves have been played")
+        if name == "measure" and len(args) != 1:
+            raise ValueError("Measure one column at a time")
+        positions, results = self.game.play((name, args)) # raises ValueError for full or out of bounds columns
+        if name == "measure":
+            args = self.game.outcome_list(positions, results)
+        data = Protocol.encode_move([player, self.game.move_no, name] + [int(a) for a in args])
+        self.Data[player] = data
+        if self.verbose:
+            self.log("Played move: " + str(Protocol.decode_move(data)))
+        return data
+
+    def stats(self):
+        latency = sorted(self.latency)
+        return {"players": sum(p is not None for p in self.players), "subscribed": len(self.subscribed),
+                "viewers": len(self.viewers), "viewers_behind": sum(v.waiting is not None for v in self.viewers.values()),
+                "viewers_dropped": self.dropped, "messages": self.messages, "hosted": self.hosted, "logged": len(self.frames),
+                "moves": self.game.move_no if self.game is not None else 0,
+                "latency_ms": {"mean": 1000*sum(latency)/len(latency) if latency else 0.0,
+                               "p95": 1000*latency[int(0.95*len(latency))] if latency else 0.0,
+                               "max": 1000*latency[-1] if latency else 0.0}}
+
+    def watch(self, conn):
+        # adds a spectator and returns the game so far: SNAPSHOT, then every move as the PUSH the others were sent
+        if not self.started:
+            raise ValueError("Room " + self.name + " has no game yet, try again once the host has sent the seed")
+        viewer = Viewer(conn)
+        viewer.sent = len(self.frames)
+        self.viewers[conn] = viewer
+        return Protocol.encode(Protocol.SNAPSHOT, (self.seed, self.depth, self.column, self.StartPlayer, len(self.frames))) + b''.join(self.frames)
+
+    def record(self, payload):
+        # adds a move to the log and sends it on to the spectators
+        player, move_no = Protocol.move_head.unpack_from(payload)[:2]
+        if move_no <= self.last[player]:
+            return
+        self.last[player] = move_no
+        self.frames.append(Protocol.encode(Protocol.PUSH, payload))
+        for viewer in list(self.viewers.values()):
+            self.send_moves(viewer)
+
+    def send_moves(self, viewer):
+        # everything the viewer has not been sent yet in one write, or nothing while it is behind
+        if viewer.waiting is not None:
+            return
+        if viewer.conn.transport.get_write_buffer_size() > viewer_buffer:
+            viewer.waiting = asyncio.ensure_future(self.catch_up(viewer))
+            return
+        viewer.conn.write(b''.join(self.frames[viewer.sent:]))
+        viewer.sent = len(self.frames)
+
+    async def catch_up(self, viewer):
+        try:
+            await asyncio.wait_for(viewer.conn.drain(), viewer_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            self.log("Dropped a spectator that fell behind")
+            self.dropped += 1
+            self.viewers.pop(viewer.conn, None)
+            viewer.conn.close()
+            return
+        viewer.waiting = None
+        if viewer.conn in self.viewers:
+            self.send_moves(viewer)
+
+    def push(self, payload, sender):
+        # forwards a move to the other subscribed players without waiting on their sockets
+        frame = Protocol.encode(Protocol.PUSH, payload)
+        for conn in self.players:
+            if conn is not None and conn is not sender and conn in self.subscribed:
+                conn.write(frame)
+
+    async def work(self, fn, *args):
+        # runs the hosted Engine's part of a message (a new game, a move) on a worker thread, so the loop keeps
+        # serving every other connection meanwhile. One at a time per room, in the order the messages came
+        async with self.busy:
+            return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def handle(self, kind, payload, conn):
+        # returns the reply as (kind, value)
+        if kind == Protocol.SEED_WANT:
+            if self.hosted and self.game is None:
+                raise ValueError("Room " + self.name + " has no game yet, try again once the host has sent the seed")
+            return Protocol.SEED, (self.seed, self.depth, self.column, self.StartPlayer) #sends initial states
+        if kind == Protocol.SEED:
+            if self.hosted and conn is not self.players[0]:
+                raise ValueError("Only the host sets the game of a hosted room")
+            self.seed, self.depth, self.column, self.StartPlayer = Protocol.decode_payload(kind, payload)
+            if self.hosted:
+                await self.work(self.start)
+            if self.started: # a new game, the spectators' logs no longer apply
+                self.close()
+            self.started = True
+            self.frames = []
+            self.last = [0, 0]
+            return Protocol.OK, None
+        if kind == Protocol.HOST:
+            if conn is not self.players[0] or self.game is not None:
+                raise ValueError("Only the host can ask for a hosted room, before sending the seed")
+            self.hosted = True
+            return Protocol.OK, None
+        if kind == Protocol.PLAY:
+            if not self.hosted:
+                raise ValueError("Room " + self.name + " relays moves, send them with MOVE")
+            data = await self.work(self.play, payload, conn)
+            self.push(data, conn)
+            self.record(data)
+            return Protocol.MOVE, data
+        if kind == Protocol.GET_MOVE:
+            iden = Protocol.decode_payload(kind, payload)
+            return Protocol.MOVE, self.Data[1-iden]
+        if kind == Protocol.MOVE:
+            if self.hosted:
+                raise ValueError("Room " + self.name + " is hosted, send moves with PLAY")
+            # stored and forwarded as received, only the player byte is looked at
+            iden = Protocol.move_player(payload)
+            self.Data[iden] = payload
+            if self.verbose:
+                self.log("Added move: " + str(Protocol.decode_move(payload)))
+            self.push(payload, conn)
+            self.record(payload)
+            return Protocol.OK, None
+        if kind == Protocol.SUBSCRIBE:
+            self.subscribed.add(conn)
+            return Protocol.OK, None
+        raise ValueError("Unexpected message kind " + str(kind))
+
+class Stats:
+    # server wide counters, each room keeps its own message count and latency
+    def __init__(self):
+        self.started = time.time()
+        self.connections = 0
+        self.open = 0
+        self.messages = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rate = 0.0 # messages per second over the last second or so
+        self.window_start = time.perf_counter()
+        self.window_count = 0
+
+    def received(self, messages, size):
+        self.messages += messages
+        self.bytes_in += size
+        self.window_count += messages
+        now = time.perf_counter()
+        if now - self.window_start >= 1.0:
+            self.rate = self.window_count/(now - self.window_start)
+            self.window_start = now
+            self.window_count = 0
+
+    def report(self, rooms):
+        if time.perf_counter() - self.window_start >= 2.0: # nothing received lately
+            self.rate = 0.0
+        return {"uptime": time.time() - self.started, "connections": self.connections, "open_connections": self.open,
+                "messages": self.messages, "messages_per_sec": self.rate, "errors": self.errors,
+                "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "rooms": dict((name, room.stats()) for name, room in rooms.items())}
+
+class GameServer:
+    # one task per connection on a single asyncio loop, games are kept in rooms looked up by name
+    def __init__(self, timeout = 600, verbose = 1, memory = 2**26):
+        self.timeout = timeout # seconds a connection may stay silent before it is closed
+        self.verbose = verbose
+        self.memory = memory # statevector bytes of each hosted game
+        self.rooms = {}
+        self.stats = Stats()
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def create(self, name, conn):
+        if name in self.rooms:
+            raise ValueError("Room " + name + " already exists")
+        self.rooms[name] = Room(name, self.verbose, self.memory)
+        return self.join(name, conn)
+
+    def join(self, name, conn):
+        if name not in self.rooms:
+            raise ValueError("No room named " + name)
+        room = self.rooms[name]
+        slot = room.add(conn)
+        if slot == -1:
+            raise ValueError("Room " + name + " is full")
+        self.log("Joined room " + name + " in slot " + str(slot))
+        return room, slot
+
+    def leave(self, room, conn):
+        if room is None:
+            return
+        room.remove(conn)
+        if room.empty() and self.rooms.get(room.name) is room: # nobody left, let the room be collected
+            room.close()
+            del self.rooms[room.name]
+            self.log("Closed room " + room.name)
+
+    def lobby(self, kind, payload, conn):
+        # CREATE or JOIN with the room name, replies with the player slot
+        if kind == Protocol.CREATE:
+            return self.create(Protocol.decode_payload(kind, payload), conn)
+        if kind == Protocol.JOIN:
+            return self.join(Protocol.decode_payload(kind, payload), conn)
+        raise ValueError("Join a room first with CREATE, JOIN or WATCH")
+
+    async def respond(self, kind, payload, conn, room):
+        # handles one message, returns the room the connection is in afterwards and the encoded reply
+        try:
+            if kind == Protocol.STATS:
+                return room, Protocol.encode(Protocol.STATS, self.stats.report(self.rooms))
+            if room is None and kind == Protocol.WATCH:
+                name = Protocol.decode_payload(kind, payload)
+                if name not in self.rooms:
+                    raise ValueError("No room named " + name)
+                room = self.rooms[name]
+                self.log("Spectating room " + name)
+                return room, room.watch(conn)
+            if room is None:
+                room, slot = self.lobby(kind, payload, conn)
+                return room, Protocol.encode(Protocol.SLOT, slot)
+            if kind == Protocol.LEAVE:
+                self.leave(room, conn)
+                return None, Protocol.encode(Protocol.OK)
+            room.messages += 1
+            if conn in room.viewers and kind not in [Protocol.SEED_WANT, Protocol.GET_MOVE]:
+                raise ValueError("Spectators can only watch")
+            reply, value = await room.handle(kind, payload, conn)
+            return room, Protocol.encode(reply, value)
+        except (ValueError, IndexError, struct.error) as e:
+            self.stats.errors += 1
+            return room, Protocol.encode(Protocol.ERROR, str(e))
+
+    async def client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        self.log("Connected to: " + str(addr))
+        self.stats.connections += 1
+        self.stats.open += 1
+        room = None
+        decoder = Protocol.Decoder()
         try:
-            data = conn.recv(2048)
-            reply = data.decode('utf-8')
-            if not data:
-                continue
-            if reply == '2':
-                conn.send(str.encode("Goodbye"))
-                #break
-            else:
-                print("Recieved: " + reply)
-                arr = reply.split(":")
-                
-                if arr[0] == "seed":
-                    if arr[1] == "want":
-                        send = str(seed) + ":" + str(depth) + ":" + str(column) + ":" + str(StartPlayer) #sends initial states
-                        print(send)
-                    else:
-                        seed = int(arr[1])
-                        depth = int(arr[2])
-                        column = int(arr[3])
-                        StartPlayer = int(arr[4])
-                        send = str(1)
-                elif len(arr) == 1: #get move
-                    iden = int(arr[0])
-                    send = Data[1-iden]
-                elif len(arr) >= 4:
-                    iden = int(arr[0])
-                    Data[iden] = reply
-                    print("Added move: " + reply)
-                    send = reply
-                print("Sending: " + send)
-                conn.sendall(str.encode(send))
-        except:
-            print("Nothing received")
-    
-    print("Connection Closed")
-    conn.close()
-
-while True:
-    conn, addr = s.accept()
-    print("Connected to: ", addr)
-    
-    start_new_thread(threaded_client, (conn,))
\ No newline at end of file
+            bye = False
+            while not bye:
+                try:
+                    data = await asyncio.wait_for(reader.read(65536), self.timeout)
+                except asyncio.TimeoutError:
+                    print("Connection timed out: ", addr)
+                    break
+                if not data: # client disconnected
+                    break
+                # answer every complete message in this read with a single write
+                start = time.perf_counter()
+                frames = decoder.feed(data)
+                self.stats.received(len(frames), len(data))
+                out = []
+                for kind, payload in frames:
+                    if kind == Protocol.BYE:
+                        out.append(Protocol.encode(Protocol.OK))
+                        bye = True
+                        break
+                    room, reply = await self.respond(kind, payload, writer, room)
+                    out.append(reply)
+                if out:
+                    out = b''.join(out)
+                    writer.write(out)
+                    await writer.drain() # waits here if the client is not reading, instead of buffering without bound
+                    self.stats.bytes_out += len(out)
+                    if room is not None:
+                        room.latency.append(time.perf_counter() - start)
+        except Protocol.ProtocolError as e:
+            writer.write(Protocol.encode(Protocol.ERROR, str(e)))
+        except ConnectionError as e:
+            print("Connection error: " + str(e))
+        finally:
+            self.stats.open -= 1
+            self.leave(room, writer)
+            self.log("Connection Closed")
+            writer.close()
+
+async def report(game, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps(game.stats.report(game.rooms)), flush = True)
+
+async def serve(host, port, timeout, verbose, interval = 0, memory = 2**26):
+    game = GameServer(timeout, verbose, memory)
+    server = await asyncio.start_server(game.client, host, port, backlog = 1024)
+    print("Server IP: " + socket.gethostbyname(host))
+    print("Waiting for a connection")
+    reporter = asyncio.create_task(report(game, interval)) if interval else None
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if reporter is not None:
+            reporter.cancel()
+            try:
+                await reporter
+            except asyncio.CancelledError:
+                pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Qonnect Four game server")
+    parser.add_argument("--host", default = '', help = "IPv4 address to listen on (default: all interfaces)")
+    parser.add_argument("--port", type = int, default = 5555)
+    parser.add_argument("--timeout", type = float, default = 600, help = "seconds before an idle connection is closed")
+    parser.add_argument("--quiet", action = "store_true", help = "do not log every message")
+    parser.add_argument("--stats", type = float, default = 0, help = "print the server counters as JSON every this many seconds")
+    parser.add_argument("--room-memory", type = float, default = 64, help = "MiB of statevector each hosted game may use")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.timeout, not args.quiet, args.stats, int(args.room_memory*2**20)))
+    except KeyboardInterrupt:
+        pass
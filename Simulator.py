@@ -0,0 +1,390 @@
+import threading
+
+import numpy as np
+
+#single qubit gate matrices, same entries as qiskit's so results match the Operator path exactly
+h_mat = np.array([[1, 1], [1, -1]], dtype=complex)/np.sqrt(2)
+y_mat = np.array([[0, -1j], [1j, 0]], dtype=complex)
+
+#diagonal gates only need the phase applied to the |1> half
+phases = {"z": -1, "s": 1j, "t": (1 + 1j)/np.sqrt(2)}
+
+#2x2 matrix of each single qubit gate, for fusing runs of them
+matrices = {"h": h_mat, "y": y_mat, "x": np.array([[0, 1], [1, 0]], dtype=complex)}
+for g in phases:
+    matrices[g] = np.diag([1, phases[g]]).astype(complex)
+identity = np.eye(2, dtype=complex)
+
+#the kernels work through states bigger than this many amplitudes a block at a time, so their temporaries
+#stay small on large boards
+block_size = 2**16
+
+#bytes a game's statevector may take (see check_memory), None for no limit
+memory_budget = 2**31
+
+#statevector sized arrays (amplitudes, their halves and |amplitude|^2) allocated, as [number, bytes] into
+#counters.current: the list of the move Trace is timing on this thread, so games on other threads do not add to it.
+#Only checked while counting, the number of tracers that asked for it with count_allocations().
+counters = threading.local()
+counting = 0
+counting_lock = threading.Lock()
+
+def count_allocations():
+    global counting
+    with counting_lock:
+        counting += 1
+
+def stop_counting():
+    # undoes one count_allocations(), the kernels skip counting again once no tracer is left
+    global counting
+    with counting_lock:
+        counting = max(counting - 1, 0)
+
+def allocated(number, nbytes):
+    counter = getattr(counters, "current", None)
+    if counter is not None:
+        counter[0] += number
+        counter[1] += number*nbytes
+
+# The kernels below work on amplitudes whose last n axes are the qubits, any leading axes are a batch of states.
+
+def index(n, qubits, values):
+    #basic-indexing tuple picking the slice where each qubit has the given value (a view, not a copy)
+    idx = [slice(None)]*n
+    for q, v in zip(qubits, values):
+        idx[n - 1 - q] = v
+    return (Ellipsis,) + tuple(idx)
+
+def blocks(n, qubits, size):
+    #basic-indexing tuples splitting an array of size amplitudes over n qubits into blocks of at most
+    #block_size amplitudes, along the highest qubits not in qubits (fixed with length 1 slices so every block keeps n axes)
+    free = [q for q in range(n - 1, -1, -1) if q not in qubits]
+    k = 0
+    while (size >> k) > block_size and k < len(free):
+        k += 1
+    for values in range(2**k):
+        idx = [slice(None)]*n
+        for j in range(k):
+            v = (values >> j) & 1
+            idx[n - 1 - free[j]] = slice(v, v + 1)
+        yield (Ellipsis,) + tuple(idx)
+
+def state_memory(n, dtype = complex):
+    #bytes a game on n qubits needs: its statevector and the kernels' temporaries, which are a few blocks at most
+    itemsize = np.dtype(dtype).itemsize
+    return 2**n*itemsize + 8*min(2**n, block_size)*itemsize
+
+def check_memory(n, dtype = complex, budget = None):
+    budget = memory_budget if budget is None else budget
+    need = state_memory(n, dtype)
+    if budget is not None and need > budget:
+        raise MemoryError("A board with " + str(n) + " columns needs " + str(need//2**20) + " MiB for its " + np.dtype(dtype).name +
+                          " statevector, more than the budget of " + str(budget//2**20) + " MiB")
+
+def apply_gate(psi, n, gate, args):
+    if psi.size > block_size:
+        for block in blocks(n, args, psi.size):
+            gate_kernel(psi[block], n, gate, args)
+    else:
+        gate_kernel(psi, n, gate, args)
+
+def gate_kernel(psi, n, gate, args):
+    target = args[-1]
+    controls = list(args[:-1])
+    idx0 = index(n, controls + [target], [1]*len(controls) + [0])
+    idx1 = index(n, controls + [target], [1]*len(controls) + [1])
+
+    if gate in ["x", "cx", "ccx"]:
+        temp = psi[idx0].copy()
+        psi[idx0] = psi[idx1]
+        psi[idx1] = temp
+        if counting:
+            allocated(1, temp.nbytes)
+    elif gate in phases:
+        psi[idx1] *= phases[gate]
+    elif gate in ["h", "y"]:
+        mat = h_mat if gate == "h" else y_mat
+        a0 = psi[idx0].copy()
+        a1 = psi[idx1]
+        psi[idx0] = mat[0][0]*a0 + mat[0][1]*a1
+        psi[idx1] = mat[1][0]*a0 + mat[1][1]*a1
+        if counting:
+            allocated(7, a0.nbytes) # the copy, four products and two sums
+    else:
+        raise ValueError("Unknown gate " + str(gate))
+
+def apply_matrix(psi, n, q, mat):
+    #any 2x2 unitary on qubit q, with cheaper paths for the diagonal and antidiagonal ones fused gates often are
+    mat = mat.astype(psi.dtype, copy = False) # complex64 states stay complex64
+    if psi.size > block_size:
+        for block in blocks(n, [q], psi.size):
+            matrix_kernel(psi[block], n, q, mat)
+    else:
+        matrix_kernel(psi, n, q, mat)
+
+def matrix_kernel(psi, n, q, mat):
+    idx0 = index(n, [q], [0])
+    idx1 = index(n, [q], [1])
+    if mat[0][1] == 0 and mat[1][0] == 0:
+        if mat[0][0] != 1:
+            psi[idx0] *= mat[0][0]
+        if mat[1][1] != 1:
+            psi[idx1] *= mat[1][1]
+    elif mat[0][0] == 0 and mat[1][1] == 0:
+        temp = psi[idx0].copy()
+        psi[idx0] = psi[idx1]
+        psi[idx1] = temp
+        if mat[0][1] != 1:
+            psi[idx0] *= mat[0][1]
+        if mat[1][0] != 1:
+            psi[idx1] *= mat[1][0]
+        if counting:
+            allocated(1, temp.nbytes)
+    else:
+        a0 = psi[idx0].copy()
+        a1 = psi[idx1]
+        psi[idx0] = mat[0][0]*a0 + mat[0][1]*a1
+        psi[idx1] = mat[1][0]*a0 + mat[1][1]*a1
+        if counting:
+            allocated(7, a0.nbytes)
+
+def marginals(data, n):
+    #(..., n, 2) array of P(qubit = 0), P(qubit = 1) for every qubit of data with shape (..., 2^n).
+    #Peels off the highest qubit and folds its halves together, so all n marginals cost ~2 passes over |psi|^2.
+    lead = data.shape[:-1]
+    if data.shape[-1] > block_size:
+        #a block of the lower qubits at a time, each block's total goes to the values its higher qubits have in it
+        low = block_size.bit_length() - 1
+        high = n - low
+        marg = np.zeros(lead + (n, 2))
+        psi = data.reshape(lead + (2**high, 2**low))
+        for b in range(2**high):
+            m = marginals(psi[..., b, :], low)
+            marg[..., :low, :] += m
+            total = m[..., 0, :].sum(axis=-1)
+            for j in range(high):
+                marg[..., low + j, (b >> j) & 1] += total
+        return marg
+    probs = np.abs(data)**2
+    if counting:
+        allocated(2, probs.nbytes)
+    marg = np.zeros(lead + (n, 2))
+    for q in range(n - 1, -1, -1):
+        probs = probs.reshape(lead + (2, -1))
+        marg[..., q, :] = probs.sum(axis=-1)
+        probs = probs[..., 0, :] + probs[..., 1, :]
+        if counting:
+            allocated(1, probs.nbytes)
+    return marg
+
+def pair_marginals(data, n):
+    #(n, n, 2, 2) array of P(qubit a = i, qubit b = j) for every pair of qubits of a single state, in one pass over
+    #|psi|^2: with the bits of the index as columns of B (2^n, n), E[x_a x_b] = B^T diag(p) B is one matrix product per block
+    low = min(n, block_size.bit_length() - 1)
+    bits = ((np.arange(2**low)[:, None] >> np.arange(low)) & 1).astype(float) # the same lower bits in every block
+    probs = data.reshape(-1, 2**low)
+    ones = np.zeros(n) # E[x_a]
+    both = np.zeros((n, n)) # E[x_a x_b]
+    total = 0.0
+    for b in range(probs.shape[0]):
+        p = np.abs(probs[b])**2
+        if counting:
+            allocated(2, p.nbytes)
+        t = p.sum()
+        e = bits.T @ p
+        high = np.array([(b >> j) & 1 for j in range(n - low)], dtype=float) # the higher qubits are fixed in a block
+        x = np.concatenate([e, high*t])
+        both[:low, :low] += bits.T @ (bits*p[:, None])
+        both[:low, low:] += np.outer(e, high)
+        both[low:, :low] += np.outer(high, e)
+        both[low:, low:] += np.outer(high, high)*t
+        ones += x
+        total += t
+    joint = np.empty((n, n, 2, 2))
+    joint[:, :, 1, 1] = both
+    joint[:, :, 1, 0] = ones[:, None] - both
+    joint[:, :, 0, 1] = ones[None, :] - both
+    joint[:, :, 0, 0] = total - ones[:, None] - ones[None, :] + both
+    return joint
+
+class QuantumState:
+    # statevector over n qubits, qiskit (little endian) ordering: qubit k is bit k of the index.
+    # Gates are queued and only applied to the amplitudes when they are read (through data, or sync()):
+    # runs of single qubit gates on a qubit are multiplied into one 2x2 matrix, identities are dropped and
+    # diagonal ones on different qubits are applied together in one pass.
+    def __init__(self, num_qubits, data = None, seed = None, dtype = complex, copy = True):
+        self.num_qubits = num_qubits
+        if data is None:
+            self.amplitudes = np.zeros(2**num_qubits, dtype=dtype)
+            self.amplitudes[0] = 1
+        else:
+            # copy = False takes over data if it already has the dtype
+            self.amplitudes = np.array(data, dtype=dtype) if copy else np.asarray(data, dtype=dtype)
+        if counting:
+            allocated(1, self.amplitudes.nbytes)
+        self.queue = [] # gates on more than one qubit in order, with what had to be applied before them
+        self.fused = {} # qubit -> 2x2 matrix of its single qubit gates since, applied after the queue
+        self.rng = np.random.default_rng(seed)
+        #single qubit marginals of the current amplitudes, reset whenever they change
+        self.cache = None
+
+    @property
+    def data(self):
+        self.sync()
+        return self.amplitudes
+
+    @data.setter
+    def data(self, value):
+        self.queue = []
+        self.fused = {}
+        self.amplitudes = value
+
+    def set(self, data):
+        #replaces the amplitudes in place, dropping any queued gates
+        self.queue = []
+        self.fused = {}
+        if self.amplitudes.flags.writeable:
+            self.amplitudes[:] = data
+        else:
+            self.amplitudes = np.array(data, dtype=self.amplitudes.dtype)
+        self.cache = None
+
+    def own(self):
+        #amplitudes shared read only (a checkpoint's, see Checkpoint.py) are copied before they are first written
+        if not self.amplitudes.flags.writeable:
+            self.amplitudes = self.amplitudes.copy()
+            if counting:
+                allocated(1, self.amplitudes.nbytes)
+
+    def pending(self):
+        return len(self.queue) + len(self.fused)
+
+    def sync(self):
+        #applies the queued gates
+        if not self.queue and not self.fused:
+            return
+        self.own()
+        n = self.num_qubits
+        psi = self.amplitudes.reshape((2,)*n)
+        for op in self.queue:
+            if op[0] == "u":
+                apply_matrix(psi, n, op[1], op[2])
+            else:
+                apply_gate(psi, n, op[0], op[1])
+        diagonal = []
+        for q, mat in self.fused.items():
+            if abs(mat - identity).max() < 1e-12: # e.g. h h or x x
+                continue
+            if mat[0][1] == 0 and mat[1][0] == 0 and mat[0][0] == 1:
+                diagonal.append((q, mat[1][1]))
+            else:
+                apply_matrix(psi, n, q, mat)
+        if len(diagonal) == 1:
+            apply_matrix(psi, n, diagonal[0][0], self.fused[diagonal[0][0]])
+        elif diagonal:
+            # all the phases at once, from a (2,)*k array broadcast over the other qubits
+            shape = [1]*n
+            phase = np.ones(1, dtype=complex)
+            for q, p in sorted(diagonal, reverse = True):
+                shape[n - 1 - q] = 2
+                phase = np.multiply.outer(phase, [1, p]).reshape(-1)
+            phase = phase.reshape([s for s in shape if s == 2]).reshape(shape).astype(psi.dtype)
+            if psi.size > block_size:
+                for block in blocks(n, [q for q, p in diagonal], psi.size):
+                    psi[block] *= phase
+            else:
+                psi *= phase
+        self.queue = []
+        self.fused = {}
+
+    def copy(self):
+        state = QuantumState(self.num_qubits, self.data, dtype = self.amplitudes.dtype)
+        state.rng = self.rng
+        return state
+
+    def tensor(self):
+        #view of the amplitudes as (2,)*n, axis 0 is the highest qubit
+        return self.data.reshape((2,)*self.num_qubits)
+
+    def axis(self, qubit):
+        return self.num_qubits - 1 - qubit
+
+    def index(self, qubits, values):
+        return index(self.num_qubits, qubits, values)
+
+    def apply(self, gate, args):
+        #queues the gate, see sync()
+        if gate not in matrices and gate not in ["cx", "ccx"]:
+            raise ValueError("Unknown gate " + str(gate))
+        if len(args) == 1:
+            q = args[0]
+            self.fused[q] = matrices[gate] @ self.fused.get(q, identity)
+        else:
+            # single qubit gates waiting on these qubits go first, the ones on other qubits commute with it
+            for q in args:
+                if q in self.fused:
+                    self.queue.append(("u", q, self.fused.pop(q)))
+            self.queue.append((gate, list(args)))
+        self.cache = None
+        return self
+
+    def marginals(self):
+        #single qubit marginals, see marginals() above
+        if self.cache is None:
+            self.cache = marginals(self.data, self.num_qubits)
+        return self.cache
+
+    def pair_marginals(self):
+        #joint distribution of every pair of qubits, see pair_marginals() above
+        return pair_marginals(self.data, self.num_qubits)
+
+    def probabilities(self, qargs = None):
+        #marginal distribution over qargs, index bit i corresponds to qargs[i] (as in qiskit)
+        if qargs is None:
+            return np.abs(self.data)**2
+        psi = self.tensor()
+        keep = [self.axis(q) for q in reversed(qargs)]
+        rest = tuple(a for a in range(self.num_qubits) if a not in keep)
+        probs = 0
+        for block in blocks(self.num_qubits, qargs, psi.size):
+            p = np.abs(psi[block])**2
+            if counting:
+                allocated(2, p.nbytes)
+            probs = probs + p.sum(axis=rest)
+        #remaining axes are in increasing axis order, put them in qargs order
+        order = sorted(keep)
+        probs = np.transpose(probs, [order.index(a) for a in keep])
+        return probs.reshape(-1)
+
+    def outcome_probabilities(self, qargs):
+        if len(qargs) == 1:
+            return self.marginals()[qargs[0]]
+        return self.probabilities(qargs)
+
+    def measure(self, qargs):
+        #samples an outcome for qargs and collapses the state onto it, returns the outcome as an int
+        probs = self.outcome_probabilities(qargs)
+        if self.amplitudes.dtype != np.complex128: # single precision sums are further from 1 than choice allows
+            probs = probs/probs.sum()
+        outcome = int(self.rng.choice(len(probs), p=probs))
+        values = [(outcome >> i) & 1 for i in range(len(qargs))]
+        self.collapse(qargs, values, probs[outcome])
+        return outcome
+
+    def project(self, qargs, values):
+        #projects onto the given outcome (values[i] for qargs[i]) and renormalises, returns the outcome's probability.
+        #Does the same arithmetic as measure, so replaying a measurement gives exactly the same amplitudes.
+        outcome = sum(v << i for i, v in enumerate(values))
+        prob = self.outcome_probabilities(qargs)[outcome]
+        if prob == 0:
+            raise ValueError("Outcome " + str(values) + " on qubits " + str(qargs) + " has zero probability")
+        self.collapse(qargs, values, prob)
+        return prob
+
+    def collapse(self, qargs, values, prob):
+        self.own()
+        psi = self.tensor()
+        for q, v in zip(qargs, values):
+            psi[self.index([q], [1 - v])] = 0
+        self.data /= np.sqrt(prob)
+        self.cache = None
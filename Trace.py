@@ -0,0 +1,124 @@
+import collections
+import json
+import threading
+import time
+
+import Simulator
+
+# Per-move instrumentation. A tracer times the phases of each move and hands one record per move to its sinks.
+# Code being timed calls mark(phase) at the end of each phase, which charges the time since the previous mark
+# (or since begin) to that phase. Games use null, whose methods do nothing, until instrument() is called.
+# A sink is any callable taking the record dict: RingBuffer, JSONLines or your own function.
+
+phases = ["validation", "evolution", "purity", "collapse", "board", "win_check", "render", "network"]
+
+class NullTracer:
+    enabled = False
+
+    def begin(self, move, **info):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def end(self, **info):
+        pass
+
+    def close(self):
+        pass
+
+null = NullTracer()
+
+class Tracer:
+    enabled = True
+
+    def __init__(self, sinks, clock = time.perf_counter):
+        self.sinks = list(sinks)
+        self.clock = clock
+        self.local = threading.local() # opponent moves are applied on the network thread
+        self.counting = True
+        Simulator.count_allocations()
+
+    def close(self):
+        # stops counting allocations for this tracer, called when the game stops using it
+        if self.counting:
+            self.counting = False
+            Simulator.stop_counting()
+
+    def __del__(self):
+        self.close()
+
+    def begin(self, move, **info):
+        # a begin inside a move (a move made from another move) is timed as part of the outer one
+        local = self.local
+        local.depth = getattr(local, "depth", 0) + 1
+        if local.depth > 1:
+            return
+        local.record = dict(move = move, time = time.time(), **info)
+        local.phases = dict.fromkeys(phases, 0.0)
+        local.outer = getattr(Simulator.counters, "current", None) # a move of another game on this thread
+        local.allocations = Simulator.counters.current = [0, 0]
+        local.start = local.last = self.clock()
+
+    def mark(self, phase):
+        local = self.local
+        if getattr(local, "depth", 0) == 0:
+            return
+        now = self.clock()
+        local.phases[phase] += now - local.last
+        local.last = now
+
+    def end(self, **info):
+        local = self.local
+        if getattr(local, "depth", 0) == 0:
+            return
+        local.depth -= 1
+        if local.depth > 0:
+            return
+        record = local.record
+        record.update(info)
+        record["total_ms"] = (self.clock() - local.start)*1000
+        record["phases_ms"] = dict((p, t*1000) for p, t in local.phases.items())
+        Simulator.counters.current = local.outer
+        record["allocations"], record["allocated_bytes"] = local.allocations
+        for sink in self.sinks:
+            sink(record)
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q*len(values)))] if values else 0.0
+
+class RingBuffer:
+    # keeps the last size records in memory
+    def __init__(self, size = 1024):
+        self.records = collections.deque(maxlen = size)
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def summary(self):
+        # mean, p95 and max in ms of every phase and of the whole move over the kept records
+        with self.lock:
+            records = list(self.records)
+        out = {}
+        for p in phases + ["total"]:
+            values = [r["total_ms"] if p == "total" else r["phases_ms"][p] for r in records]
+            out[p] = {"mean_ms": sum(values)/len(values) if values else 0.0,
+                      "p95_ms": percentile(values, 0.95), "max_ms": max(values) if values else 0.0}
+        return out
+
+class JSONLines:
+    # appends one JSON line per record to a file
+    def __init__(self, path):
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, default = str) + "\n") # numpy ints and the like as strings
+            self.file.flush()
+
+    def close(self):
+        self.file.close()